@@ -1,147 +1,2568 @@
 from email.mime.text import MIMEText
 import smtplib
+import asyncio
+import base64
+import bisect
+import csv
+import socket
+import ssl
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
 import ttkbootstrap as ttkb
 from ttkbootstrap.constants import *
 import imaplib
 import email
+import email.header
+import hashlib
+import heapq
 import json
+import mailbox
 import os
+import time
 from datetime import datetime, timedelta
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, deque
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from wordcloud import WordCloud
 import re
+import html
+import queue
+import sqlite3
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import urllib.parse
+import zlib
+import numpy as np
 from PIL import Image, ImageTk
 
 
+FETCH_RESPONSE_START = re.compile(rb'^(\d+) \(')
+FETCH_LITERAL_ITEM = re.compile(rb'([A-Z0-9.]+(?:\[[^\]]*\])?(?:<\d+>)?) \{\d+\}$', re.IGNORECASE)
+FETCH_RFC822_SIZE = re.compile(rb'RFC822\.SIZE (\d+)', re.IGNORECASE)
+FETCH_UID = re.compile(rb'UID (\d+)', re.IGNORECASE)
+# Fetch items that set \Seen (RFC 3501 6.4.5); BODY.PEEK[], RFC822.SIZE and RFC822.HEADER do not
+FETCH_SETS_SEEN = re.compile(r'\bRFC822(?![.](?:SIZE|HEADER))|\bBODY\[', re.IGNORECASE)
+IMAP_LIST_TOKEN = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}|([^\s()"]+))', re.DOTALL)
+IMAP_LINE_LIMIT = 2 ** 24
+IMAP_IDLE_TIMEOUT = 29 * 60
+# Seconds an SMTP connect or command may stall before the send fails
+SMTP_TIMEOUT = 60
+IMAP_TAGGED_RESPONSE = re.compile(rb'^(?P<tag>\S+) (?P<type>[A-Z]+)(?: (?P<data>.*))?$', re.DOTALL)
+IMAP_UNTAGGED_RESPONSE = re.compile(rb'^\* (?P<type>[A-Za-z-]+)(?: (?P<data>.*))?$', re.DOTALL)
+IMAP_UNTAGGED_STATUS = re.compile(rb'^\* (?P<data>\d+) (?P<type>[A-Za-z-]+)(?: (?P<data2>.*))?$', re.DOTALL)
+IMAP_RESPONSE_CODE = re.compile(rb'\[(?P<type>[A-Za-z-]+)(?: (?P<data>.*?))?\]')
+IMAP_LITERAL = re.compile(rb'.*\{(?P<size>\d+)\}$', re.DOTALL)
+MESSAGE_TEXT_LIMIT = 64 * 1024
+HTML_INVISIBLE = re.compile(r'<(script|style|head)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+HTML_TAG = re.compile(r'<[^>]+>')
+REGEX_CONDITIONS = {'from_regex': 'from', 'subject_regex': 'subject', 'body_regex': 'body'}
+COMPOSITE_CONDITIONS = ('all', 'any', 'not')
+# Relative evaluation cost of each leaf condition; body conditions force a decode
+CONDITION_COSTS = {'from': 1, 'subject': 1, 'domain': 1, 'from_regex': 2, 'subject_regex': 2, 'body': 10, 'body_regex': 12}
+CLASSIFIER_CATEGORIES = ('OTP', 'Promotions', 'Updates', 'General')
+CLASSIFIER_DIMENSIONS = 2 ** 18
+CLASSIFIER_BODY_CHARS = 4000
+CLASSIFIER_TOKEN = re.compile(r'\w+')
+ANALYTICS_HEADER_FIELDS = ('FROM', 'DATE', 'SUBJECT', 'IN-REPLY-TO')
+# Sketched analytics bin message sizes by log2 with this many bins per doubling (about 9% wide)
+SIZE_BINS_PER_OCTAVE = 8
+SIZE_BIN_EDGES = 2.0 ** (np.arange(SIZE_BINS_PER_OCTAVE * 40 + 1) / SIZE_BINS_PER_OCTAVE)
+AUTO_REPLY_HEADER_FIELDS = ('FROM', 'SUBJECT', 'LIST-ID', 'AUTO-SUBMITTED', 'PRECEDENCE')
+NO_REPLY_ADDRESS = re.compile(r'^(?:no-?reply|do-?not-?reply|mailer-daemon|postmaster|bounces?)\b', re.IGNORECASE)
+
+
+# Group message numbers into IMAP sequence sets ("1:500,502") of at most batch_size messages
+def build_sequence_sets(nums, batch_size=500):
+    nums = sorted({int(n) for n in nums})
+    sequence_sets = []
+    for start in range(0, len(nums), max(1, batch_size)):
+        chunk = nums[start:start + max(1, batch_size)]
+        ranges = []
+        run_start = prev = chunk[0]
+        for num in chunk[1:]:
+            if num == prev + 1:
+                prev = num
+                continue
+            ranges.append(f"{run_start}:{prev}" if prev != run_start else f"{run_start}")
+            run_start = prev = num
+        ranges.append(f"{run_start}:{prev}" if prev != run_start else f"{run_start}")
+        sequence_sets.append(",".join(ranges))
+    return sequence_sets
+
+
+# Split an imaplib FETCH response into (message number, metadata, literals) per message.
+# Each literal is paired with the FETCH item it belongs to, e.g. (b'RFC822', b'...')
+def parse_fetch_response(data):
+    messages = []
+    for item in data:
+        if item is None:
+            continue
+        head, literal = item if isinstance(item, tuple) else (item, None)
+        match = FETCH_RESPONSE_START.match(head)
+        if match or not messages:
+            messages.append((match.group(1) if match else b'', [head], []))
+        else:
+            messages[-1][1].append(head)
+        if literal is not None:
+            item_name = FETCH_LITERAL_ITEM.search(head)
+            messages[-1][2].append((item_name.group(1).upper() if item_name else b'', literal))
+    return [(num, b''.join(heads), literals) for num, heads, literals in messages]
+
+
+# Parse one parenthesized IMAP list (e.g. a BODYSTRUCTURE) into nested Python lists
+def parse_imap_list(data, pos=0):
+    stack = [[]]
+    while pos < len(data):
+        match = IMAP_LIST_TOKEN.match(data, pos)
+        if not match:
+            break
+        pos = match.end()
+        open_paren, close_paren, quoted, literal, atom = match.groups()
+        if open_paren:
+            stack.append([])
+        elif close_paren:
+            if len(stack) == 1:
+                break
+            finished = stack.pop()
+            stack[-1].append(finished)
+            if len(stack) == 1:
+                break
+        elif quoted is not None:
+            stack[-1].append(re.sub(rb'\\(.)', rb'\1', quoted).decode('utf-8', 'replace'))
+        elif literal is not None:
+            # Literals inside BODYSTRUCTURE are rare and never needed for analytics
+            stack[-1].append(None)
+        else:
+            stack[-1].append(None if atom.upper() == b'NIL' else atom.decode('utf-8', 'replace'))
+    return (stack[0][0] if stack[0] else None), pos
+
+
+def _bodystructure_param(params, name):
+    if not isinstance(params, list):
+        return None
+    pairs = dict(zip(params[0::2], params[1::2]))
+    for key, value in pairs.items():
+        if not isinstance(key, str) or value is None:
+            continue
+        if key.lower() == name:
+            return value
+        if key.lower() == name + '*':
+            charset, _, text = email.utils.decode_rfc2231(value)
+            return urllib.parse.unquote(text, encoding=charset or 'utf-8', errors='replace')
+    return None
+
+
+# Attachment file extensions found in a parsed BODYSTRUCTURE, matching what
+# walking the downloaded message with get_filename() would report
+def bodystructure_attachment_types(structure):
+    extensions = []
+
+    def walk(part):
+        if not isinstance(part, list) or not part:
+            return
+        if isinstance(part[0], list):
+            for child in part:
+                if not isinstance(child, list):
+                    break
+                walk(child)
+            return
+        disposition = next((field for field in part[7:] if isinstance(field, list) and len(field) == 2
+                            and isinstance(field[0], str) and (field[1] is None or isinstance(field[1], list))), None)
+        if disposition is not None:
+            file_name = _bodystructure_param(disposition[1], 'filename') or _bodystructure_param(part[2], 'name')
+            if file_name:
+                extensions.append(os.path.splitext(file_name)[1].lower())
+        if str(part[0]).lower() == 'message' and str(part[1]).lower() == 'rfc822' and len(part) > 8:
+            walk(part[8])
+
+    if isinstance(structure, list) and structure and isinstance(structure[0], list):
+        walk(structure)
+    return extensions
+
+
+def imap_quote(value):
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+# Run one FETCH (or UID FETCH) for a sequence set and return its messages in order
+def fetch_sequence_set(connection, sequence_set, query, uid=False):
+    if uid:
+        typ, data = connection.uid('FETCH', sequence_set, query)
+    else:
+        typ, data = connection.fetch(sequence_set, query)
+    return collect_fetch_response(typ, data, sequence_set, uid)
+
+
+def collect_fetch_response(typ, data, sequence_set, uid=False):
+    if typ != 'OK':
+        raise imaplib.IMAP4.error(f"FETCH {sequence_set} failed: {data}")
+    fetched = [m for m in parse_fetch_response(data) if m[2]]
+    if uid:
+        # Responses are keyed by UID; skip unsolicited FETCHes that carry none
+        fetched = [(FETCH_UID.search(meta).group(1), meta, literals)
+                   for _, meta, literals in fetched if FETCH_UID.search(meta)]
+    fetched.sort(key=lambda m: int(m[0]))
+    return fetched
+
+
+# Header values as plain text safe to store (compat32 may hand back Header objects or surrogates)
+def header_text(value):
+    if value is None:
+        return None
+    return str(value).encode('utf-8', 'surrogateescape').decode('utf-8', 'replace')
+
+
+# Decode RFC 2047 encoded words ("=?utf-8?q?...?=") into display text
+def decode_header_text(value):
+    if value is None:
+        return None
+    try:
+        return header_text(email.header.make_header(email.header.decode_header(str(value))))
+    except Exception:
+        return header_text(value)
+
+
+def html_to_text(markup):
+    text = HTML_TAG.sub(' ', HTML_INVISIBLE.sub(' ', markup))
+    return re.sub(r'\s+', ' ', html.unescape(text)).strip()
+
+
+# Decoded body text: the first text/plain part, else (optionally) the first text/html part
+# with tags stripped. Transfer encoding and charset are undone; at most limit characters are kept
+def message_text(email_message, limit=MESSAGE_TEXT_LIMIT, include_html=True):
+    html_text = None
+    for part in email_message.walk():
+        content_type = part.get_content_type()
+        if content_type not in ('text/plain', 'text/html') or part.get_filename():
+            continue
+        if content_type == 'text/html' and (not include_html or html_text is not None):
+            continue
+        # No charset needs more than 4 bytes per character, so the rest is never decoded
+        payload = (part.get_payload(decode=True) or b'')[:limit * 4]
+        try:
+            text = payload.decode(part.get_content_charset() or 'utf-8', 'replace')
+        except LookupError:
+            text = payload.decode('utf-8', 'replace')
+        if content_type == 'text/plain':
+            return text[:limit]
+        html_text = html_to_text(text)
+    return (html_text or '')[:limit]
+
+
+class MessageView:
+    # One downloaded message as rules, auto-reply and indexing see it. Headers read through;
+    # the body is decoded on first access and then shared by every consumer of this message
+    def __init__(self, email_message, limit=MESSAGE_TEXT_LIMIT, include_html=True):
+        self.message = email_message
+        self.limit = limit
+        self.include_html = include_html
+        self._body = None
+        self._body_lower = None
+        self._headers_lower = {}
+
+    @classmethod
+    def of(cls, email_message):
+        return email_message if isinstance(email_message, cls) else cls(email_message)
+
+    def __getitem__(self, name):
+        return self.message[name]
+
+    def get(self, name, failobj=None):
+        return self.message.get(name, failobj)
+
+    @property
+    def body(self):
+        if self._body is None:
+            self._body = message_text(self.message, self.limit, self.include_html)
+        return self._body
+
+    @property
+    def body_decoded(self):
+        return self._body is not None
+
+    @property
+    def body_lower(self):
+        if self._body_lower is None:
+            self._body_lower = self.body.lower()
+        return self._body_lower
+
+    def header_lower(self, name):
+        if name not in self._headers_lower:
+            self._headers_lower[name] = str(self.message[name] or '').lower()
+        return self._headers_lower[name]
+
+
+# The per-message facts analytics and search need, built from a header-only fetch
+def header_record(uid, size, header_message, attachment_exts):
+    date_tuple = email.utils.parsedate_tz(header_message['Date'])
+    return {
+        'uid': uid,
+        'date': email.utils.mktime_tz(date_tuple) if date_tuple else None,
+        'sender': header_text(email.utils.parseaddr(header_text(header_message['From']) or '')[1]),
+        'subject': header_text(header_message['Subject']),
+        'in_reply_to': bool(header_message['In-Reply-To']),
+        'size': size,
+        'attachments': attachment_exts
+    }
+
+
+# Local calendar day and wall-clock hour of every timestamp (NaN when undated). Only one local
+# midnight per day in range goes through datetime; timestamps are placed with searchsorted.
+# Returns the day names and, per timestamp, a day index and an hour, both -1 when undated
+def local_days_and_hours(timestamps):
+    timestamps = np.asarray(timestamps, dtype=float)
+    day_index = np.full(len(timestamps), -1, dtype=np.int64)
+    hours = np.full(len(timestamps), -1, dtype=np.int64)
+    dated = ~np.isnan(timestamps)
+    if not dated.any():
+        return [], day_index, hours
+    values = timestamps[dated]
+    first = datetime.fromtimestamp(values.min()).date()
+    last = datetime.fromtimestamp(values.max()).date()
+    dates = [first + timedelta(days=offset) for offset in range((last - first).days + 2)]
+    midnights = np.array([datetime(date.year, date.month, date.day).timestamp() for date in dates])
+    index = np.searchsorted(midnights, values, side='right') - 1
+    elapsed = ((values - midnights[index]) // 3600).astype(np.int64)
+    # On a DST change day the wall-clock hour is not the number of hours since midnight
+    irregular = np.isin(index, np.flatnonzero(np.diff(midnights) != 86400))
+    if irregular.any():
+        elapsed[irregular] = [datetime.fromtimestamp(value).hour for value in values[irregular]]
+    day_index[dated] = index
+    hours[dated] = np.clip(elapsed, 0, 23)
+    return [date.strftime("%Y-%m-%d") for date in dates[:-1]], day_index, hours
+
+
+# Identifies exactly which messages a day's rollup was built from, and whether its sizes are binned
+def rollup_signature(uidvalidity, uids, binned=False):
+    return [uidvalidity, len(uids), zlib.crc32(','.join(map(str, sorted(uids))).encode('ascii')), bool(binned)]
+
+
+# Everything analyze_emails reports, for one day of header records in UID order with their local
+# hours. The first and last dates let merge_rollups stitch response times across day boundaries.
+# binned keeps sizes as [bins, counts] of the log bins instead of one value per message
+def day_rollup(records, hours, binned=False):
+    senders = defaultdict(int)
+    keywords = defaultdict(int)
+    attachments = defaultdict(int)
+    for record in records:
+        senders[record['sender']] += 1
+        for word in (record['subject'] or '').lower().split():
+            if len(word) > 3:
+                keywords[word] += 1
+        for file_ext in record['attachments']:
+            attachments[file_ext] += 1
+    dates = np.array([record['date'] if record['date'] is not None else np.nan for record in records], dtype=float)
+    replies = np.array([bool(record['in_reply_to']) for record in records], dtype=bool)
+    # A reply's response time runs from the message before it; an undated neighbour gives NaN
+    gaps = np.diff(dates) / 60
+    counted = replies[1:] & ~np.isnan(gaps)
+    sizes = [record['size'] for record in records]
+    if binned:
+        bins, counts = np.unique(size_bin(sizes), return_counts=True)
+        size_field = {'size_bins': [bins.tolist(), counts.tolist()]}
+    else:
+        size_field = {'sizes': sizes}
+    return {'total': len(records), 'senders': senders, 'hours': np.bincount(hours[hours >= 0], minlength=24).tolist(),
+            'keywords': keywords, **size_field, 'attachments': attachments,
+            'response_minutes': float(gaps[counted].sum()), 'responses': int(counted.sum()),
+            'first_date': records[0]['date'] if records else None,
+            'first_reply': bool(records[0]['in_reply_to']) if records else False,
+            'last_date': records[-1]['date'] if records else None}
+
+
+# Indices of the k largest counts, largest first
+def top_k(counts, k):
+    index = np.argpartition(counts, -k)[-k:] if len(counts) > k else np.arange(len(counts))
+    return index[np.argsort(-counts[index], kind='stable')]
+
+
+# Sums (day, rollup) pairs, oldest first, into the analytics dict analyze_emails returns; any
+# iterable will do, so the rollups can be read one day at a time. Counts are summed as arrays;
+# sizes stay one value per message for the percentiles and histogram.
+# With a sketch_capacity, senders and keywords go through HeavyHitters and sizes into log bins,
+# so memory stays fixed however long the window; only the top sketch_capacity items are reported
+def merge_rollups(day_rollups, sketch_capacity=0):
+    sender_hitters = HeavyHitters(sketch_capacity) if sketch_capacity else None
+    keyword_hitters = HeavyHitters(sketch_capacity) if sketch_capacity else None
+    size_bins = np.zeros(len(SIZE_BIN_EDGES) - 1, dtype=np.int64)
+    sender_ids = {}
+    ids = []
+    id_counts = []
+    keywords = defaultdict(int)
+    attachments = defaultdict(int)
+    hour_weekday = np.zeros((7, 24), dtype=np.int64)
+    size_columns = []
+    total = 0
+    response_minutes = 0.0
+    responses = 0
+    last_date = None
+    for day, rollup in day_rollups:
+        if not rollup['total']:
+            continue
+        total += rollup['total']
+        if sketch_capacity:
+            sender_hitters.add(rollup['senders'])
+            keyword_hitters.add(rollup['keywords'])
+            if 'size_bins' in rollup:
+                bins, counts = rollup['size_bins']
+                size_bins[np.asarray(bins, dtype=np.int64)] += np.asarray(counts, dtype=np.int64)
+            else:
+                size_bins += np.bincount(size_bin(rollup['sizes']), minlength=len(size_bins))
+        else:
+            for sender, count in rollup['senders'].items():
+                ids.append(sender_ids.setdefault(sender, len(sender_ids)))
+                id_counts.append(count)
+            for word, count in rollup['keywords'].items():
+                keywords[word] += count
+            size_columns.append(np.asarray(rollup['sizes'], dtype=np.int64))
+        for file_ext, count in rollup['attachments'].items():
+            attachments[file_ext] += count
+        if day:
+            hour_weekday[datetime.strptime(day, "%Y-%m-%d").weekday()] += rollup['hours']
+        response_minutes += rollup['response_minutes']
+        responses += rollup['responses']
+        if rollup['first_reply'] and last_date is not None and rollup['first_date'] is not None:
+            response_minutes += (rollup['first_date'] - last_date) / 60
+            responses += 1
+        last_date = rollup['last_date']
+
+    hourly_counts = hour_weekday.sum(axis=0)
+    analytics = {
+        'total_emails': total,
+        'hourly_distribution': {hour: int(count) for hour, count in enumerate(hourly_counts) if count},
+        'hourly_counts': hourly_counts,
+        'hour_weekday': hour_weekday,
+        'average_response_time': response_minutes / responses if responses else 0,
+        'attachment_types': attachments,
+        'sketched': bool(sketch_capacity)
+    }
+    if sketch_capacity:
+        analytics['sender_frequency'] = sender_hitters.counts()
+        analytics['top_senders'] = sender_hitters.top(10)
+        analytics['subject_keywords'] = keyword_hitters.counts()
+        analytics['email_sizes'] = np.zeros(0, dtype=np.int64)
+        analytics['size_percentiles'] = binned_percentiles(size_bins, (50, 90, 99))
+        used = np.flatnonzero(size_bins)
+        analytics['size_histogram'] = ((size_bins[used[0]:used[-1] + 1], SIZE_BIN_EDGES[used[0]:used[-1] + 2])
+                                       if len(used) else None)
+        return analytics
+
+    names = list(sender_ids)
+    sender_counts = np.bincount(np.asarray(ids, dtype=np.int64), weights=id_counts,
+                                minlength=len(names)).astype(np.int64)
+    sizes = np.concatenate(size_columns) if size_columns else np.zeros(0, dtype=np.int64)
+    analytics.update({
+        'sender_frequency': dict(zip(names, sender_counts.tolist())),
+        'top_senders': [(names[index], int(sender_counts[index])) for index in top_k(sender_counts, 10)],
+        'subject_keywords': keywords,
+        'email_sizes': sizes,
+        'size_percentiles': dict(zip((50, 90, 99), np.percentile(sizes, [50, 90, 99]).tolist())) if len(sizes) else {},
+        'size_histogram': np.histogram(sizes, bins=15) if len(sizes) else None
+    })
+    return analytics
+
+
+def size_bin(sizes):
+    return np.clip((np.log2(np.maximum(np.asarray(sizes, dtype=float), 1)) * SIZE_BINS_PER_OCTAVE).astype(np.int64),
+                   0, len(SIZE_BIN_EDGES) - 2)
+
+
+# Percentiles read off a log-binned size histogram; each is the upper edge of its bin
+def binned_percentiles(size_bins, percentiles):
+    total = size_bins.sum()
+    if not total:
+        return {}
+    cumulative = np.cumsum(size_bins)
+    return {percentile: float(SIZE_BIN_EDGES[np.searchsorted(cumulative, total * percentile / 100) + 1])
+            for percentile in percentiles}
+
+
+class SpaceSaving:
+    # Space-Saving top-k summary (Metwally et al.): at most `capacity` counters. A count can
+    # overestimate by at most the count of the item it evicted, and every item occurring more
+    # than total/capacity times is guaranteed to be held
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        # One (count, item) entry per held item, holding the count it was inserted with
+        self.heap = []
+
+    def add(self, item, count=1):
+        if item in self.counts:
+            self.counts[item] += count
+            return
+        if len(self.counts) >= self.capacity:
+            count += self.evict()
+        self.counts[item] = count
+        heapq.heappush(self.heap, (count, item))
+
+    def evict(self):
+        # Counts only grow, so an entry that no longer matches goes back in with its current count
+        while True:
+            count, item = heapq.heappop(self.heap)
+            current = self.counts[item]
+            if current == count:
+                del self.counts[item]
+                return count
+            heapq.heappush(self.heap, (current, item))
+
+
+class CountMinSketch:
+    # depth rows of width counters. An estimate never undercounts and, with probability
+    # 1 - e**-depth, overcounts by at most e/width of the total
+    def __init__(self, width, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+
+    def indices(self, items):
+        # One blake2b digest per item, split into an independent 32-bit hash per row
+        digests = b''.join(hashlib.blake2b(item.encode('utf-8', 'surrogateescape'), digest_size=4 * self.depth).digest()
+                           for item in items)
+        return (np.frombuffer(digests, dtype='<u4').reshape(-1, self.depth) % self.width).T
+
+    def add(self, items, counts):
+        indices = self.indices(items)
+        for row in range(self.depth):
+            np.add.at(self.table[row], indices[row], counts)
+
+    def estimate(self, items):
+        indices = self.indices(items)
+        return self.table[np.arange(self.depth)[:, None], indices].min(axis=0)
+
+
+class HeavyHitters:
+    # Space-Saving picks the candidates and Count-Min tightens their counts: both only ever
+    # overestimate, so the smaller of the two is kept. Memory is fixed by capacity
+    def __init__(self, capacity):
+        self.summary = SpaceSaving(capacity)
+        self.sketch = CountMinSketch(max(256, 8 * capacity))
+
+    def add(self, counts):
+        if not counts:
+            return
+        for item, count in counts.items():
+            self.summary.add(item, count)
+        self.sketch.add(list(counts), np.fromiter(counts.values(), dtype=np.int64, count=len(counts)))
+
+    def counts(self):
+        items = list(self.summary.counts)
+        if not items:
+            return {}
+        estimates = np.minimum(np.fromiter(self.summary.counts.values(), dtype=np.int64, count=len(items)),
+                               self.sketch.estimate(items))
+        return dict(zip(items, estimates.tolist()))
+
+    def top(self, k):
+        return heapq.nlargest(k, self.counts().items(), key=lambda item: item[1])
+
+
+# Searchable fields of a fully downloaded message (an email.message.Message or a MessageView)
+def index_entry(uid, email_message):
+    view = MessageView.of(email_message)
+    record = header_record(uid, None, view, [])
+    record['subject'] = decode_header_text(view['Subject'])
+    record['sender_text'] = decode_header_text(view['From'])
+    record['body'] = view.body
+    return record
+
+
+# One row of the Search tab; header cache records carry no folder and are always from INBOX
+def search_result(record):
+    date = datetime.fromtimestamp(record['date']) if record['date'] is not None else None
+    return {
+        'subject': record['subject'],
+        'sender': record['sender'],
+        'folder': record.get('folder', 'INBOX'),
+        'date': date.strftime("%Y-%m-%d %H:%M:%S") if date else ''
+    }
+
+
+class HeaderCache:
+    def __init__(self, path='email_cache.db'):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS headers (
+                account TEXT, folder TEXT, uidvalidity INTEGER, uid INTEGER,
+                date REAL, sender TEXT, subject TEXT, in_reply_to INTEGER,
+                size INTEGER, attachments TEXT,
+                PRIMARY KEY (account, folder, uidvalidity, uid)
+            )""")
+        self.db.commit()
+
+    def get(self, account, folder, uidvalidity, uids):
+        wanted = set(uids)
+        if not wanted:
+            return {}
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT uid, date, sender, subject, in_reply_to, size, attachments FROM headers "
+                "WHERE account = ? AND folder = ? AND uidvalidity = ? AND uid BETWEEN ? AND ?",
+                (account, folder, uidvalidity, min(wanted), max(wanted))).fetchall()
+        return {
+            row[0]: {'uid': row[0], 'date': row[1], 'sender': row[2], 'subject': row[3],
+                     'in_reply_to': bool(row[4]), 'size': row[5], 'attachments': json.loads(row[6])}
+            for row in rows if row[0] in wanted
+        }
+
+    def put(self, account, folder, uidvalidity, records):
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(account, folder, uidvalidity, r['uid'], r['date'], r['sender'], r['subject'],
+                  int(r['in_reply_to']), r['size'], json.dumps(r['attachments'])) for r in records])
+            self.db.commit()
+
+    def dates(self, account, folder, uidvalidity, uids):
+        # Like get(), but only the date of each cached UID
+        wanted = set(uids)
+        if not wanted:
+            return {}
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT uid, date FROM headers WHERE account = ? AND folder = ? AND uidvalidity = ? "
+                "AND uid BETWEEN ? AND ?", (account, folder, uidvalidity, min(wanted), max(wanted))).fetchall()
+        return {uid: {'uid': uid, 'date': date} for uid, date in rows if uid in wanted}
+
+    def drop_stale(self, account, folder, uidvalidity):
+        # A new UIDVALIDITY means every cached UID for the folder is meaningless
+        with self.lock:
+            self.db.execute("DELETE FROM headers WHERE account = ? AND folder = ? AND uidvalidity != ?",
+                            (account, folder, uidvalidity))
+            self.db.commit()
+
+
+class AnalyticsRollups:
+    # One day_rollup per folder and local day, kept next to the header cache. A rollup is reused
+    # only while the day still holds exactly the UIDs it was built from
+    def __init__(self, path='email_cache.db'):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS analytics_rollups (
+                account TEXT, folder TEXT, day TEXT, signature TEXT, rollup TEXT,
+                PRIMARY KEY (account, folder, day)
+            )""")
+        self.db.commit()
+
+    def signatures(self, account, folder):
+        # day -> signature, without reading the rollups themselves
+        with self.lock:
+            rows = self.db.execute("SELECT day, signature FROM analytics_rollups WHERE account = ? AND folder = ?",
+                                   (account, folder)).fetchall()
+        return {day: json.loads(signature) for day, signature in rows}
+
+    def get(self, account, folder, day):
+        # Parsed one day at a time, so a long window never holds every rollup at once
+        with self.lock:
+            row = self.db.execute("SELECT rollup FROM analytics_rollups WHERE account = ? AND folder = ? AND day = ?",
+                                  (account, folder, day)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, account, folder, rollups):
+        # rollups: (day, signature, rollup)
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO analytics_rollups VALUES (?, ?, ?, ?, ?)",
+                                [(account, folder, day, json.dumps(signature), json.dumps(rollup))
+                                 for day, signature, rollup in rollups])
+            self.db.commit()
+
+
+class OutboundSpool:
+    # Auto-replies waiting to be sent, kept in email_cache.db so a crash or restart loses none.
+    # A reply is deleted once the server accepts it, so one interrupted mid-send goes out again
+    def __init__(self, path='email_cache.db'):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS outbound (
+                id INTEGER PRIMARY KEY, account TEXT, recipient TEXT, message BLOB,
+                queued_at REAL, next_attempt REAL, attempts INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0, last_error TEXT
+            )""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS outbound_due ON outbound (account, failed, next_attempt)")
+        self.db.commit()
+
+    def enqueue(self, account, messages):
+        now = time.time()
+        with self.lock:
+            self.db.executemany(
+                "INSERT INTO outbound (account, recipient, message, queued_at, next_attempt) VALUES (?, ?, ?, ?, ?)",
+                [(account, msg['To'], msg.as_bytes(), now, now) for msg in messages])
+            self.db.commit()
+
+    def next_due(self, account):
+        # (id, message bytes, attempts) of the oldest reply due now, or the time the next one is due
+        with self.lock:
+            row = self.db.execute(
+                "SELECT id, message, attempts, next_attempt FROM outbound "
+                "WHERE account = ? AND NOT failed ORDER BY next_attempt, id LIMIT 1", (account,)).fetchone()
+        if row is None:
+            return None, None
+        if row[3] > time.time():
+            return None, row[3]
+        return row[:3], None
+
+    def remove(self, message_id):
+        with self.lock:
+            self.db.execute("DELETE FROM outbound WHERE id = ?", (message_id,))
+            self.db.commit()
+
+    def retry(self, message_id, error, next_attempt):
+        with self.lock:
+            self.db.execute("UPDATE outbound SET attempts = attempts + 1, next_attempt = ?, last_error = ? WHERE id = ?",
+                            (next_attempt, error, message_id))
+            self.db.commit()
+
+    def fail(self, message_id, error):
+        # Kept for inspection rather than deleted, but never retried
+        with self.lock:
+            self.db.execute("UPDATE outbound SET attempts = attempts + 1, failed = 1, last_error = ? WHERE id = ?",
+                            (error, message_id))
+            self.db.commit()
+
+    def counts(self, account):
+        with self.lock:
+            rows = self.db.execute("SELECT failed, COUNT(*) FROM outbound WHERE account = ? GROUP BY failed",
+                                   (account,)).fetchall()
+        counts = dict(rows)
+        return counts.get(0, 0), counts.get(1, 0)
+
+
+class RecentReplies:
+    # Senders auto-replied to recently, per account, so each gets at most one reply per window.
+    # Bounded: expired entries are dropped and only the newest max_entries are kept
+    def __init__(self, path='email_cache.db', max_entries=50000):
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS recent_replies (
+                account TEXT, sender TEXT, replied_at REAL,
+                PRIMARY KEY (account, sender)
+            )""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS recent_replies_age ON recent_replies (replied_at)")
+        self.db.commit()
+
+    def claim(self, account, senders, window):
+        # Returns the senders not replied to within `window` seconds and records them as replied
+        now = time.time()
+        wanted = list(dict.fromkeys(sender.lower() for sender in senders))
+        if not wanted:
+            return set()
+        with self.lock:
+            self.db.execute("DELETE FROM recent_replies WHERE replied_at < ?", (now - window,))
+            recent = set()
+            for start in range(0, len(wanted), 500):
+                chunk = wanted[start:start + 500]
+                recent.update(row[0] for row in self.db.execute(
+                    f"SELECT sender FROM recent_replies WHERE account = ? AND sender IN ({','.join('?' * len(chunk))})",
+                    [account] + chunk))
+            claimed = [sender for sender in wanted if sender not in recent]
+            self.db.executemany("INSERT OR REPLACE INTO recent_replies VALUES (?, ?, ?)",
+                                [(account, sender, now) for sender in claimed])
+            self.db.execute("DELETE FROM recent_replies WHERE rowid NOT IN "
+                            "(SELECT rowid FROM recent_replies ORDER BY replied_at DESC LIMIT ?)", (self.max_entries,))
+            self.db.commit()
+        return set(claimed)
+
+
+class SearchIndex:
+    # SQLite FTS5 index over subject, sender and decoded body text, kept next to the header cache
+    def __init__(self, path='email_cache.db'):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS indexed_messages (
+                id INTEGER PRIMARY KEY, account TEXT, folder TEXT, uidvalidity INTEGER, uid INTEGER,
+                date REAL, sender TEXT, subject TEXT, has_body INTEGER DEFAULT 0,
+                UNIQUE (account, folder, uidvalidity, uid)
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+                subject, sender, body, tokenize = 'unicode61 remove_diacritics 2'
+            );
+            CREATE TABLE IF NOT EXISTS indexed_folders (
+                account TEXT, folder TEXT, uidvalidity INTEGER, synced_at REAL,
+                PRIMARY KEY (account, folder)
+            );""")
+        self.db.commit()
+
+    def add(self, account, folder, uidvalidity, entries):
+        # entries carry uid, date, sender, subject and body (None when only headers are known)
+        with self.lock:
+            for entry in entries:
+                row = self.db.execute(
+                    "SELECT id, has_body FROM indexed_messages WHERE account = ? AND folder = ? AND uidvalidity = ? AND uid = ?",
+                    (account, folder, uidvalidity, entry['uid'])).fetchone()
+                has_body = entry['body'] is not None
+                if row and (row[1] or not has_body):
+                    continue
+                if row:
+                    row_id = row[0]
+                    self.db.execute("DELETE FROM search_index WHERE rowid = ?", (row_id,))
+                    self.db.execute("UPDATE indexed_messages SET date = ?, sender = ?, subject = ?, has_body = 1 WHERE id = ?",
+                                    (entry['date'], entry['sender'], entry['subject'], row_id))
+                else:
+                    row_id = self.db.execute(
+                        "INSERT INTO indexed_messages (account, folder, uidvalidity, uid, date, sender, subject, has_body) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (account, folder, uidvalidity, entry['uid'], entry['date'], entry['sender'], entry['subject'],
+                         int(has_body))).lastrowid
+                self.db.execute("INSERT INTO search_index (rowid, subject, sender, body) VALUES (?, ?, ?, ?)",
+                                (row_id, entry['subject'] or '', entry.get('sender_text') or entry['sender'] or '',
+                                 entry['body'] or ''))
+            self.db.commit()
+
+    def indexed_uids(self, account, folder, uidvalidity):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT uid FROM indexed_messages WHERE account = ? AND folder = ? AND uidvalidity = ? AND has_body = 1",
+                (account, folder, uidvalidity)).fetchall()
+        return {row[0] for row in rows}
+
+    def delete_where(self, condition, params):
+        self.db.execute(f"DELETE FROM search_index WHERE rowid IN (SELECT id FROM indexed_messages WHERE {condition})", params)
+        self.db.execute(f"DELETE FROM indexed_messages WHERE {condition}", params)
+
+    def remove(self, account, folder, uids):
+        with self.lock:
+            for uid in uids:
+                self.delete_where("account = ? AND folder = ? AND uid = ?", (account, folder, int(uid)))
+            self.db.commit()
+
+    def drop_stale(self, account, folder, uidvalidity):
+        with self.lock:
+            self.delete_where("account = ? AND folder = ? AND uidvalidity != ?", (account, folder, uidvalidity))
+            self.db.commit()
+
+    def mark_synced(self, account, folder, uidvalidity):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO indexed_folders VALUES (?, ?, ?, ?)",
+                            (account, folder, uidvalidity, datetime.now().timestamp()))
+            self.db.commit()
+
+    def prune(self, account, folder, uidvalidity, uids):
+        # Drops messages no longer in the folder, e.g. deleted or moved by another client
+        keep = set(uids)
+        with self.lock:
+            rows = self.db.execute("SELECT uid FROM indexed_messages WHERE account = ? AND folder = ? AND uidvalidity = ?",
+                                   (account, folder, uidvalidity)).fetchall()
+            for (uid,) in rows:
+                if uid not in keep:
+                    self.delete_where("account = ? AND folder = ? AND uid = ?", (account, folder, uid))
+            self.db.commit()
+
+    def synced_folders(self, account):
+        with self.lock:
+            rows = self.db.execute("SELECT folder FROM indexed_folders WHERE account = ?", (account,)).fetchall()
+        return {row[0] for row in rows}
+
+    def drop_folder(self, account, folder):
+        with self.lock:
+            self.delete_where("account = ? AND folder = ?", (account, folder))
+            self.db.execute("DELETE FROM indexed_folders WHERE account = ? AND folder = ?", (account, folder))
+            self.db.commit()
+
+    def is_synced(self, account=None):
+        with self.lock:
+            if account is None:
+                row = self.db.execute("SELECT COUNT(*) FROM indexed_folders").fetchone()
+            else:
+                row = self.db.execute("SELECT COUNT(*) FROM indexed_folders WHERE account = ?", (account,)).fetchone()
+        return row[0] > 0
+
+    def search(self, query, account=None, since=None, limit=500):
+        # Every word must match, each as a prefix ("inv" finds "invoice")
+        terms = re.findall(r'\w+', query)
+        if not terms:
+            return []
+        match = ' '.join('"' + term.replace('"', '""') + '"*' for term in terms)
+        sql = ("SELECT m.folder, m.uid, m.date, m.subject, m.sender FROM search_index "
+               "JOIN indexed_messages m ON m.id = search_index.rowid WHERE search_index MATCH ?")
+        params = [match]
+        if account is not None:
+            sql += " AND m.account = ?"
+            params.append(account)
+        if since is not None:
+            sql += " AND m.date >= ?"
+            params.append(since)
+        sql += " ORDER BY m.date DESC LIMIT ?"
+        params.append(limit)
+        with self.lock:
+            rows = self.db.execute(sql, params).fetchall()
+        return [{'folder': row[0], 'uid': row[1], 'date': row[2], 'subject': row[3], 'sender': row[4]} for row in rows]
+
+
+class IMAPConnectionPool:
+    # Seconds to wait for a busy session before giving up on the batch
+    ACQUIRE_TIMEOUT = 120
+
+    def __init__(self, host, email_address, password, size=4):
+        self.host = host
+        self.email_address = email_address
+        self.password = password
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def open_connection(self):
+        connection = imaplib.IMAP4_SSL(self.host)
+        connection.login(self.email_address, self.password)
+        return [connection, None]
+
+    def acquire(self, folder):
+        # Reuse an idle session, open a new one while under the limit, otherwise wait
+        try:
+            entry = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_open = self.created < self.size
+                if can_open:
+                    self.created += 1
+            if can_open:
+                try:
+                    entry = self.open_connection()
+                except Exception:
+                    with self.lock:
+                        self.created -= 1
+                    raise
+            else:
+                try:
+                    entry = self.idle.get(timeout=self.ACQUIRE_TIMEOUT)
+                except queue.Empty:
+                    raise imaplib.IMAP4.error(
+                        f"No pooled IMAP session became free within {self.ACQUIRE_TIMEOUT} seconds") from None
+        if entry[1] != folder:
+            # Read-only EXAMINE: pooled sessions only fetch, they never change flags
+            try:
+                typ, data = entry[0].select(folder if folder == 'INBOX' else imap_quote(folder), readonly=True)
+            except (imaplib.IMAP4.abort, OSError):
+                self.release(entry, broken=True)
+                raise
+            if typ != 'OK':
+                self.release(entry, broken=True)
+                raise imaplib.IMAP4.error(f"SELECT {folder} failed: {data}")
+            entry[1] = folder
+        return entry
+
+    def release(self, entry, broken=False):
+        if broken:
+            with self.lock:
+                self.created -= 1
+            try:
+                entry[0].logout()
+            except Exception:
+                pass
+        else:
+            self.idle.put(entry)
+
+    def run(self, folder, func, items):
+        # Yield func(connection, item) for every item, in order, spread across the pool's sessions
+        def task(item):
+            entry = self.acquire(folder)
+            broken = False
+            try:
+                return func(entry[0], item)
+            except (imaplib.IMAP4.abort, OSError):
+                broken = True
+                raise
+            finally:
+                # A NO reply (IMAP4.error) leaves the session usable; only a dead one is thrown away
+                self.release(entry, broken)
+
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            pending = []
+            for item in items:
+                pending.append(executor.submit(task, item))
+                # Keep at most two batches per session in flight so memory stays bounded
+                if len(pending) >= self.size * 2:
+                    yield pending.pop(0).result()
+            for future in pending:
+                yield future.result()
+
+    def close(self):
+        while True:
+            try:
+                entry = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                entry[0].logout()
+            except Exception:
+                pass
+        with self.lock:
+            self.created = 0
+
+
+class AsyncEngine:
+    # One event loop thread shared by every account, folder and SMTP session in the process
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="EchoBoxAsyncEngine", daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine, timeout=None):
+        return self.submit(coroutine).result(timeout)
+
+
+class AsyncIMAPClient:
+    def __init__(self, host, port=993, use_ssl=True):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.reader = None
+        self.writer = None
+        self.reader_task = None
+        self.tag_counter = 0
+        # tag -> (future, untagged responses collected while the command was in flight)
+        self.pending = {}
+        self.unsolicited = {}
+        self.select_responses = {}
+        self.capabilities = ()
+        self.closed = None
+        self.continuation = None
+        self.idle_event = None
+        # Set by any EXISTS, including one that arrives during another command
+        self.exists_seen = False
+
+    async def connect(self):
+        context = ssl.create_default_context() if self.use_ssl else None
+        self.reader, self.writer = await asyncio.open_connection(
+            self.host, self.port, ssl=context, limit=IMAP_LINE_LIMIT)
+        greeting = await self.read_line()
+        if not greeting.startswith((b'* OK', b'* PREAUTH')):
+            raise imaplib.IMAP4.error(f"Unexpected IMAP greeting: {greeting!r}")
+        self.reader_task = asyncio.ensure_future(self.read_responses())
+        await self.capability()
+
+    async def read_line(self):
+        line = await self.reader.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("socket error: EOF")
+        return line[:-2] if line.endswith(b'\r\n') else line.rstrip(b'\n')
+
+    async def read_responses(self):
+        try:
+            while True:
+                line = await self.read_line()
+                if line.startswith(b'* '):
+                    await self.read_untagged(line)
+                elif line.startswith(b'+'):
+                    if self.continuation and not self.continuation.done():
+                        self.continuation.set_result(line)
+                else:
+                    self.complete_command(line)
+        except Exception as e:
+            self.closed = e if isinstance(e, imaplib.IMAP4.abort) else imaplib.IMAP4.abort(f"socket error: {e}")
+            for future, _ in self.pending.values():
+                if not future.done():
+                    future.set_exception(self.closed)
+            self.pending.clear()
+
+    def current_bucket(self):
+        # Servers answer pipelined commands in order, so untagged data belongs to the oldest one
+        return next(iter(self.pending.values()), (None, self.unsolicited))[1]
+
+    async def read_untagged(self, line):
+        match = IMAP_UNTAGGED_STATUS.match(line)
+        if match:
+            typ, dat = match.group('type'), match.group('data')
+            if match.group('data2'):
+                dat = dat + b' ' + match.group('data2')
+        else:
+            match = IMAP_UNTAGGED_RESPONSE.match(line)
+            if not match:
+                return
+            typ, dat = match.group('type'), match.group('data') or b''
+        typ = typ.decode('ascii').upper()
+        bucket = self.current_bucket()
+        if typ in ('OK', 'NO', 'BAD', 'BYE', 'PREAUTH'):
+            code = IMAP_RESPONSE_CODE.match(dat)
+            if code:
+                bucket.setdefault(code.group('type').decode('ascii').upper(), []).append(code.group('data'))
+        literal = IMAP_LITERAL.match(dat)
+        while literal:
+            data = await self.reader.readexactly(int(literal.group('size')))
+            bucket.setdefault(typ, []).append((dat, data))
+            dat = await self.read_line()
+            literal = IMAP_LITERAL.match(dat)
+        bucket.setdefault(typ, []).append(dat)
+        if typ == 'EXISTS':
+            self.exists_seen = True
+        if self.idle_event and typ in ('EXISTS', 'BYE'):
+            self.idle_event.set()
+
+    def complete_command(self, line):
+        match = IMAP_TAGGED_RESPONSE.match(line)
+        if not match or match.group('tag') not in self.pending:
+            return
+        future, bucket = self.pending.pop(match.group('tag'))
+        text = match.group('data') or b''
+        code = IMAP_RESPONSE_CODE.match(text)
+        if code:
+            bucket.setdefault(code.group('type').decode('ascii').upper(), []).append(code.group('data'))
+        if not future.done():
+            future.set_result((match.group('type').decode('ascii'), bucket, text))
+
+    async def command(self, name, *args):
+        # Commands are written immediately, so callers may keep many of them in flight
+        if self.closed:
+            raise self.closed
+        self.tag_counter += 1
+        tag = f"EB{self.tag_counter:05d}".encode('ascii')
+        parts = [tag, name.encode('ascii')]
+        parts += [arg if isinstance(arg, bytes) else str(arg).encode('utf-8') for arg in args if arg is not None]
+        future = asyncio.get_running_loop().create_future()
+        self.pending[tag] = (future, {})
+        self.writer.write(b' '.join(parts) + b'\r\n')
+        await self.writer.drain()
+        typ, bucket, text = await future
+        if typ == 'BAD':
+            raise imaplib.IMAP4.error(f"{name} command error: {typ} [{text!r}]")
+        return typ, bucket, text
+
+    async def simple_command(self, name, *args, response=None):
+        # Same (typ, data) shapes imaplib returns, so callers can use either engine
+        typ, bucket, text = await self.command(name, *args)
+        if name in ('SELECT', 'EXAMINE'):
+            self.select_responses = bucket
+        if typ == 'NO' or response is None:
+            return typ, [text]
+        return typ, bucket.get(response, [None])
+
+    async def capability(self):
+        typ, data = await self.simple_command('CAPABILITY', response='CAPABILITY')
+        if data and data[-1]:
+            self.capabilities = tuple(data[-1].decode('ascii', 'replace').upper().split())
+        return typ, data
+
+    async def login(self, user, password):
+        typ, data = await self.simple_command('LOGIN', imap_quote(user), imap_quote(password))
+        if typ != 'OK':
+            raise imaplib.IMAP4.error(data[-1])
+        await self.capability()
+        return typ, data
+
+    async def list(self, directory='""', pattern='*'):
+        return await self.simple_command('LIST', directory, pattern, response='LIST')
+
+    async def select(self, mailbox='INBOX', readonly=False):
+        result = await self.simple_command('EXAMINE' if readonly else 'SELECT', mailbox, response='EXISTS')
+        # The count SELECT reports is the starting point, not new mail
+        self.exists_seen = False
+        return result
+
+    def response(self, code):
+        return code, self.select_responses.pop(code, [None])
+
+    async def search(self, charset, *criteria):
+        args = ('CHARSET', charset) if charset else ()
+        return await self.simple_command('SEARCH', *args, *criteria, response='SEARCH')
+
+    async def fetch(self, message_set, message_parts):
+        return await self.simple_command('FETCH', message_set, message_parts, response='FETCH')
+
+    async def uid(self, command, *args):
+        command = command.upper()
+        response = command if command in ('SEARCH', 'SORT', 'THREAD') else 'FETCH'
+        return await self.simple_command('UID', command, *args, response=response)
+
+    async def copy(self, message_set, new_mailbox):
+        return await self.simple_command('COPY', message_set, new_mailbox)
+
+    async def store(self, message_set, command, flags):
+        return await self.simple_command('STORE', message_set, command, flags, response='FETCH')
+
+    async def expunge(self):
+        return await self.simple_command('EXPUNGE', response='EXPUNGE')
+
+    async def noop(self):
+        return await self.simple_command('NOOP')
+
+    async def idle(self, timeout=IMAP_IDLE_TIMEOUT):
+        # RFC 2177: park the session until the server reports new mail (or the timeout
+        # expires), then leave IDLE with DONE and return the EXISTS counts seen
+        if self.exists_seen:
+            # Mail arrived since the last idle(); the caller has not seen it yet
+            self.exists_seen = False
+            return 'OK', [b'']
+        self.continuation = asyncio.get_running_loop().create_future()
+        self.idle_event = asyncio.Event()
+        command = asyncio.ensure_future(self.command('IDLE'))
+        try:
+            await asyncio.wait({self.continuation, command}, return_when=asyncio.FIRST_COMPLETED)
+            if command.done():
+                typ, _, text = command.result()
+                return typ, [text]
+            try:
+                await asyncio.wait_for(self.idle_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.writer.write(b'DONE\r\n')
+            await self.writer.drain()
+            typ, bucket, _ = await command
+            self.exists_seen = False
+            return typ, bucket.get('EXISTS', [])
+        finally:
+            self.continuation = None
+            self.idle_event = None
+
+    def wake_idle(self):
+        if self.idle_event:
+            self.idle_event.set()
+
+    async def logout(self):
+        try:
+            return await self.simple_command('LOGOUT', response='BYE')
+        except imaplib.IMAP4.abort:
+            return 'BYE', [None]
+        finally:
+            if self.reader_task:
+                self.reader_task.cancel()
+            self.writer.close()
+
+
+class AsyncSMTPClient:
+    def __init__(self, host, port=587, use_ssl=False):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.reader = None
+        self.writer = None
+        self.extensions = {}
+
+    async def connect(self):
+        context = ssl.create_default_context() if self.use_ssl else None
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=context)
+        await self.expect(220)
+        await self.ehlo()
+
+    async def read_reply(self):
+        lines = []
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            lines.append(line[4:].rstrip(b'\r\n'))
+            if line[3:4] != b'-':
+                return int(line[:3]), b'\n'.join(lines)
+
+    async def expect(self, *codes):
+        code, message = await self.read_reply()
+        if code not in codes:
+            raise smtplib.SMTPResponseException(code, message)
+        return code, message
+
+    async def command(self, line, *codes):
+        self.writer.write(line.encode('utf-8') + b'\r\n')
+        await self.writer.drain()
+        return await self.expect(*codes)
+
+    async def ehlo(self):
+        _, message = await self.command(f"EHLO {socket.getfqdn()}", 250)
+        self.extensions = {}
+        for line in message.decode('utf-8', 'replace').split('\n')[1:]:
+            keyword, _, params = line.partition(' ')
+            self.extensions[keyword.upper()] = params
+
+    async def starttls(self):
+        await self.command("STARTTLS", 220)
+        await self.writer.start_tls(ssl.create_default_context(), server_hostname=self.host)
+        await self.ehlo()
+
+    async def login(self, user, password):
+        if 'PLAIN' in self.extensions.get('AUTH', '').upper().split():
+            token = base64.b64encode(f"\0{user}\0{password}".encode('utf-8')).decode('ascii')
+            return await self.command(f"AUTH PLAIN {token}", 235, 503)
+        await self.command("AUTH LOGIN", 334)
+        await self.command(base64.b64encode(user.encode('utf-8')).decode('ascii'), 334)
+        return await self.command(base64.b64encode(password.encode('utf-8')).decode('ascii'), 235, 503)
+
+    async def send_message(self, msg):
+        sender = email.utils.parseaddr(msg['From'])[1]
+        recipients = [address for _, address in email.utils.getaddresses(msg.get_all('To', []) + msg.get_all('Cc', []))]
+        envelope = [f"MAIL FROM:<{sender}>"] + [f"RCPT TO:<{address}>" for address in recipients] + ["DATA"]
+        if 'PIPELINING' in self.extensions:
+            # RFC 2920: the whole envelope goes out in one write, replies are read afterwards.
+            # Every reply is read even after a refusal, so none is left for the next command
+            self.writer.write(''.join(line + '\r\n' for line in envelope).encode('utf-8'))
+            await self.writer.drain()
+            replies = [await self.read_reply() for _ in envelope]
+        else:
+            replies = []
+            for line in envelope:
+                self.writer.write(line.encode('utf-8') + b'\r\n')
+                await self.writer.drain()
+                replies.append(await self.read_reply())
+                if replies[0][0] != 250:
+                    break
+
+        mail_reply, rcpt_replies, data_reply = replies[0], replies[1:len(envelope) - 1], replies[-1]
+        refused = {address: reply for address, reply in zip(recipients, rcpt_replies) if reply[0] not in (250, 251)}
+        if mail_reply[0] != 250:
+            error = smtplib.SMTPSenderRefused(mail_reply[0], mail_reply[1], sender)
+        elif len(refused) == len(recipients):
+            error = smtplib.SMTPRecipientsRefused(refused)
+        elif data_reply[0] != 354:
+            error = smtplib.SMTPDataError(*data_reply)
+        else:
+            error = None
+        if error:
+            if data_reply[0] == 354:
+                # The server is waiting for a body we will not send; the session cannot be reused
+                self.writer.close()
+                raise smtplib.SMTPServerDisconnected(f"Envelope refused after DATA was accepted: {error}")
+            # Like smtplib: RSET clears the failed transaction so the session stays usable
+            await self.command("RSET", 250)
+            raise error
+
+        payload = re.sub(rb'(?m)^\.', b'..', re.sub(rb'\r?\n', b'\r\n', msg.as_bytes()))
+        if not payload.endswith(b'\r\n'):
+            payload += b'\r\n'
+        self.writer.write(payload + b'.\r\n')
+        await self.writer.drain()
+        code, message = await self.read_reply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, message)
+        return refused
+
+    async def noop(self):
+        return await self.command("NOOP", 250)
+
+    async def quit(self):
+        try:
+            return await self.command("QUIT", 221)
+        finally:
+            self.writer.close()
+
+
+class SyncIMAPFacade:
+    # imaplib-compatible blocking interface over AsyncIMAPClient, for code running outside the loop
+    def __init__(self, engine, host, port=993):
+        self.engine = engine
+        self.client = AsyncIMAPClient(host, port)
+        self.engine.run(self.client.connect())
+
+    def wake_idle(self):
+        # Safe to call from any thread; ends a blocking idle() call early
+        self.engine.loop.call_soon_threadsafe(self.client.wake_idle)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if asyncio.iscoroutinefunction(attribute):
+            return lambda *args: self.engine.run(attribute(*args))
+        return attribute
+
+    def fetch_pipelined(self, sequence_sets, query, uid=False, depth=8):
+        # Keep up to `depth` FETCH commands in flight on the one connection, yielding in order
+        pending = []
+        for sequence_set in sequence_sets:
+            coroutine = self.client.uid('FETCH', sequence_set, query) if uid else self.client.fetch(sequence_set, query)
+            pending.append((sequence_set, self.engine.submit(coroutine)))
+            if len(pending) >= depth:
+                sequence_set, future = pending.pop(0)
+                yield sequence_set, future.result()
+        for sequence_set, future in pending:
+            yield sequence_set, future.result()
+
+
+class SyncSMTPFacade:
+    # smtplib.SMTP-compatible blocking interface over AsyncSMTPClient
+    def __init__(self, engine, host, port=587):
+        self.engine = engine
+        self.client = AsyncSMTPClient(host, port, use_ssl=(port == 465))
+        self.engine.run(asyncio.wait_for(self.client.connect(), SMTP_TIMEOUT))
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if asyncio.iscoroutinefunction(attribute):
+            return lambda *args: self.engine.run(asyncio.wait_for(attribute(*args), SMTP_TIMEOUT))
+        return attribute
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self.quit()
+        except Exception:
+            pass
+
+
+class SMTPSession:
+    # One logged-in SMTP connection kept open across sends. A send on a connection the server
+    # has dropped (idle timeout, 421) reconnects and retries once
+    def __init__(self, organizer, host, port):
+        self.organizer = organizer
+        self.host = host
+        self.port = port
+        self.email_address = organizer.email_address
+        self.smtp = None
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def connect(self):
+        smtp = self.organizer.open_smtp(self.host, self.port)
+        try:
+            if self.port != 465:
+                smtp.starttls()
+            smtp.login(self.organizer.email_address, self.organizer.password)
+        except Exception:
+            self.quit(smtp)
+            raise
+        return smtp
+
+    def send(self, msg):
+        try:
+            with self.lock:
+                if self.closed:
+                    raise smtplib.SMTPServerDisconnected("SMTP session was closed")
+                return self.send_message(msg)
+        finally:
+            # A close() while this send held the lock left the connection for us to drop
+            if self.closed:
+                self.close()
+
+    def send_message(self, msg):
+        for attempt in range(2):
+            if self.smtp is None:
+                self.smtp = self.connect()
+            try:
+                return self.smtp.send_message(msg)
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code != 421 or attempt:
+                    raise
+            except smtplib.SMTPServerDisconnected:
+                if attempt:
+                    raise
+            except smtplib.SMTPException:
+                raise
+            except OSError:
+                # Socket errors; SMTPException is an OSError too, hence the clause above
+                if attempt:
+                    raise
+            self.quit(self.smtp)
+            self.smtp = None
+
+    def quit(self, smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        # Called from the Tk thread, so it never waits for a send in progress; that send
+        # drops the connection itself once it finishes
+        self.closed = True
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            if self.smtp:
+                self.quit(self.smtp)
+                self.smtp = None
+        finally:
+            self.lock.release()
+
+
+class AutoReplySender:
+    # Drains the outbound spool on its own thread, so processing never waits on SMTP. Sends at
+    # most rate_per_minute replies; a failed send is retried with exponential backoff
+    MAX_ATTEMPTS = 8
+    BASE_DELAY = 30
+    MAX_DELAY = 3600
+
+    def __init__(self, organizer):
+        self.organizer = organizer
+        self.stopping = threading.Event()
+        self.wakeup = threading.Event()
+        self.next_send = 0.0
+        self.paused_until = 0.0
+        self.thread = None
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name="EchoBoxAutoReplySender", daemon=True)
+            self.thread.start()
+        self.wake()
+
+    def wake(self):
+        self.wakeup.set()
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+
+    def run(self):
+        while not self.stopping.is_set():
+            # Cleared before looking at the spool, so a wake() that lands meanwhile is not lost
+            self.wakeup.clear()
+            try:
+                delay = self.send_next()
+            except Exception as e:
+                print(f"Error sending auto-reply: {e}")
+                delay = self.BASE_DELAY
+            # None waits until wake() or stop(); only 0 goes straight on
+            if delay != 0:
+                self.wakeup.wait(delay)
+
+    def backoff(self, attempts):
+        return min(self.BASE_DELAY * 2 ** attempts, self.MAX_DELAY)
+
+    def send_next(self):
+        # Returns how long to sleep (None: until woken), 0 to go straight on to the next reply
+        account = self.organizer.email_address
+        now = time.monotonic()
+        if not account or not self.organizer.password:
+            return None
+        if now < max(self.next_send, self.paused_until):
+            return max(self.next_send, self.paused_until) - now
+        row, due_at = self.organizer.outbound_spool.next_due(account)
+        if row is None:
+            return max(due_at - time.time(), 0.1) if due_at else None
+        message_id, message_bytes, attempts = row
+        msg = email.message_from_bytes(message_bytes)
+        session = self.organizer.smtp()
+        rate = max(float(self.organizer.auto_reply_settings.get('rate_per_minute') or 20), 0.1)
+        self.next_send = now + 60 / rate
+        try:
+            session.send(msg)
+        except Exception as e:
+            # 5xx is the server refusing this reply for good; anything else may clear up
+            permanent = (isinstance(e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused))
+                         and not isinstance(e, smtplib.SMTPAuthenticationError)
+                         and getattr(e, 'smtp_code', 550) >= 500 and session.smtp is not None)
+            if permanent or attempts + 1 >= self.MAX_ATTEMPTS:
+                print(f"Giving up on auto-reply to {msg['To']}: {e}")
+                self.organizer.outbound_spool.fail(message_id, str(e))
+            else:
+                delay = self.backoff(attempts)
+                self.organizer.outbound_spool.retry(message_id, str(e), time.time() + delay)
+                if session.smtp is None:
+                    # Could not connect or log in; every other reply would fail the same way
+                    self.paused_until = time.monotonic() + delay
+            return 0
+        self.organizer.outbound_spool.remove(message_id)
+        return 0
+
+
+class InboxWatcher:
+    # Holds an IDLE session on the folder and runs the rules on each newly arrived UID
+    def __init__(self, organizer, folder='INBOX', on_result=None):
+        self.organizer = organizer
+        self.folder = folder
+        self.on_result = on_result or print
+        self.stopping = threading.Event()
+        self.connection = None
+        self.thread = threading.Thread(target=self.run, name="EchoBoxInboxWatcher", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.connection:
+            self.connection.wake_idle()
+
+    def open_session(self):
+        self.connection = SyncIMAPFacade(AsyncEngine.shared(), self.organizer.imap_host)
+        self.connection.login(self.organizer.email_address, self.organizer.password)
+        typ, data = self.connection.select(self.folder)
+        if typ != 'OK':
+            raise imaplib.IMAP4.error(f"SELECT {self.folder} failed: {data}")
+        _, uidnext = self.connection.response('UIDNEXT')
+        if uidnext and uidnext[0]:
+            return int(uidnext[0]) - 1
+        _, data = self.connection.uid('SEARCH', None, 'ALL')
+        return max((int(uid) for uid in data[0].split()), default=0) if data and data[0] else 0
+
+    def run(self):
+        last_uid = None
+        while not self.stopping.is_set():
+            try:
+                high_water = self.open_session()
+                last_uid = high_water if last_uid is None else last_uid
+                self.on_result(f"Watching {self.folder} for new mail")
+                while not self.stopping.is_set():
+                    # Searched before every IDLE, so mail that arrived while the previous batch
+                    # was being processed (or while reconnecting) is picked up straight away
+                    # "n:*" always matches the highest UID, so filter out what was already handled
+                    _, data = self.connection.uid('SEARCH', None, f'UID {last_uid + 1}:*')
+                    uids = [uid for uid in (data[0].split() if data and data[0] else []) if int(uid) > last_uid]
+                    if uids:
+                        last_uid = max(int(uid) for uid in uids)
+                        processed = self.organizer.process_uids(uids, self.connection, '(BODY.PEEK[])')
+                        self.on_result(f"Processed {processed} of {len(uids)} new emails")
+                    if self.stopping.is_set():
+                        break
+                    typ, exists = self.connection.idle()
+                    if typ != 'OK':
+                        raise imaplib.IMAP4.error(f"IDLE failed: {exists}")
+            except Exception as e:
+                self.on_result(f"Error watching inbox: {e}")
+                # Back off before reconnecting, unless we were asked to stop
+                self.stopping.wait(30)
+            finally:
+                if self.connection:
+                    try:
+                        self.connection.logout()
+                    except Exception:
+                        pass
+                    self.connection = None
+        self.on_result("Stopped watching inbox")
+
+
+# RFC 3834: no automatic answers to automatic mail, mailing lists, bulk mail or no-reply senders
+def auto_reply_allowed(email_message, own_address=None):
+    auto_submitted = str(email_message['Auto-Submitted'] or 'no').strip().lower()
+    precedence = str(email_message['Precedence'] or '').strip().lower()
+    if email_message['List-Id'] or auto_submitted != 'no' or precedence in ('bulk', 'list', 'junk'):
+        return False
+    sender = email.utils.parseaddr(str(email_message['From'] or ''))[1]
+    if '@' not in sender or NO_REPLY_ADDRESS.match(sender):
+        return False
+    return not own_address or sender.lower() != own_address.lower()
+
+
+def sender_domain(email_message):
+    address = email.utils.parseaddr(str(email_message['From'] or ''))[1]
+    return address.rpartition('@')[2].lower() if '@' in address else ''
+
+
+# A domain rule's value lists one or more domains, separated by commas or whitespace
+def rule_domains(value):
+    return {domain.lstrip('@').lower() for domain in re.split(r'[,\s]+', value) if domain.lstrip('@')}
+
+
+class PatternAutomaton:
+    # Aho-Corasick as a full DFA: one pass over a text reports every pattern it contains
+    def __init__(self, patterns):
+        self.transitions = [{}]
+        self.outputs = [set()]
+        for pattern, value in patterns:
+            state = 0
+            for char in pattern:
+                next_state = self.transitions[state].get(char)
+                if next_state is None:
+                    next_state = len(self.transitions)
+                    self.transitions[state][char] = next_state
+                    self.transitions.append({})
+                    self.outputs.append(set())
+                state = next_state
+            self.outputs[state].add(value)
+
+        # Breadth-first, so each failure state is complete before its dependents copy it
+        fail = [0] * len(self.transitions)
+        trie = [dict(transitions) for transitions in self.transitions]
+        pending = deque(trie[0].values())
+        while pending:
+            state = pending.popleft()
+            self.transitions[state] = dict(self.transitions[fail[state]], **trie[state])
+            self.outputs[state] |= self.outputs[fail[state]]
+            for char, next_state in trie[state].items():
+                fail[next_state] = self.transitions[fail[state]].get(char, 0) if state else 0
+                pending.append(next_state)
+        self.outputs = [frozenset(values) if values else None for values in self.outputs]
+        self.min_value = min((value for _, value in patterns), default=None)
+
+    def search(self, text):
+        transitions, outputs = self.transitions, self.outputs
+        found = set()
+        state = 0
+        for char in text:
+            state = transitions[state].get(char, 0)
+            if outputs[state]:
+                found |= outputs[state]
+        return found
+
+
+def compile_condition(condition):
+    # Returns (cost, predicate). all/any children run cheapest first and short-circuit, so a
+    # body is only decoded once the header predicates in front of it have passed
+    condition_type = condition.get('condition_type')
+    if condition_type in COMPOSITE_CONDITIONS:
+        children = sorted((compile_condition(child) for child in condition.get('conditions', [])),
+                          key=lambda child: child[0])
+        predicates = [predicate for _, predicate in children]
+        cost = sum(child_cost for child_cost, _ in children)
+        if condition_type == 'all':
+            return cost, lambda view: all(predicate(view) for predicate in predicates)
+        if condition_type == 'any':
+            return cost, lambda view: any(predicate(view) for predicate in predicates)
+        if len(predicates) != 1:
+            raise ValueError("a 'not' condition takes exactly one condition")
+        return cost, lambda view: not predicates[0](view)
+
+    value = str(condition.get('condition_value', ''))
+    cost = CONDITION_COSTS.get(condition_type, 0)
+    if condition_type == 'body':
+        needle = value.lower()
+        return cost, lambda view: needle in view.body_lower
+    if condition_type in ('from', 'subject'):
+        needle = value.lower()
+        return cost, lambda view: needle in view.header_lower(condition_type)
+    if condition_type == 'domain':
+        domains = rule_domains(value)
+        return cost, lambda view: sender_domain(view) in domains
+    if condition_type in REGEX_CONDITIONS:
+        field = REGEX_CONDITIONS[condition_type]
+        pattern = re.compile(value, re.IGNORECASE)
+        if field == 'body':
+            return cost, lambda view: pattern.search(view.body) is not None
+        return cost, lambda view: pattern.search(str(view[field] or '')) is not None
+    return cost, lambda view: False
+
+
+def condition_reads_subject_digits(condition):
+    if condition.get('condition_type') in COMPOSITE_CONDITIONS:
+        return any(condition_reads_subject_digits(child) for child in condition.get('conditions', []))
+    if condition.get('condition_type') in ('subject', 'subject_regex'):
+        return bool(re.search(r'\d', str(condition.get('condition_value', ''))))
+    return False
+
+
+def condition_reads_body(condition):
+    if condition.get('condition_type') in COMPOSITE_CONDITIONS:
+        return any(condition_reads_body(child) for child in condition.get('conditions', []))
+    return condition.get('condition_type') in ('body', 'body_regex')
+
+
+# The From header plus the subject with every digit folded to 0: "Your code is 482913" and
+# "Your code is 110374" from the same sender share a template
+def message_fingerprint(email_message):
+    sender = re.sub(r'\s+', ' ', str(email_message['From'] or '')).strip().lower()
+    subject = re.sub(r'\s+', ' ', decode_header_text(email_message['Subject']) or '').strip().lower()
+    return sender, re.sub(r'\d', '0', subject)
+
+
+class TemplateCache:
+    # Folder decisions per message template with least-recently-used eviction. Each decision
+    # belongs to one rule set / classifier state; binding a different signature empties the cache
+    def __init__(self, size=10000):
+        self.size = size
+        self.entries = OrderedDict()
+        self.signature = None
+        self.hits = 0
+        self.misses = 0
+
+    def bind(self, signature):
+        if signature != self.signature:
+            self.entries.clear()
+            self.signature = signature
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, self.entries[key]
+        self.misses += 1
+        return False, None
+
+    def put(self, key, decision):
+        self.entries[key] = decision
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+
+# How a rule's condition reads in the rules list, e.g. "all(from: boss, not(subject: fyi))"
+def describe_condition(condition):
+    if condition.get('condition_type') in COMPOSITE_CONDITIONS:
+        children = ', '.join(describe_condition(child) for child in condition.get('conditions', []))
+        return f"{condition['condition_type']}({children})"
+    return f"{condition.get('condition_type')}: {condition.get('condition_value')}"
+
+
+class CompiledRuleSet:
+    # Every rule compiled once: one automaton per field for substring rules, a domain -> rule
+    # hash for domain rules, and predicates for regex and composite rules. The lowest
+    # matching rule index wins
+    FIELDS = ('from', 'subject', 'body')
+
+    def __init__(self, rules):
+        self.rules = [dict(rule) for rule in rules]
+        patterns = defaultdict(list)
+        self.domains = defaultdict(list)
+        # Predicates that only read headers run before the body is decoded, the rest after it
+        self.header_predicates = []
+        self.body_predicates = []
+        # Which evaluation stage covers each rule; automata and the domain hash serve many rules at once
+        self.rule_stage = {}
+        for index, rule in enumerate(self.rules):
+            condition_type = rule.get('condition_type')
+            value = str(rule.get('condition_value', ''))
+            if condition_type in self.FIELDS:
+                patterns[condition_type].append((value.lower(), index))
+                self.rule_stage[index] = condition_type
+            elif condition_type == 'domain':
+                for domain in rule_domains(value):
+                    self.domains[domain].append(index)
+                self.rule_stage[index] = 'domain'
+            elif condition_type in REGEX_CONDITIONS or condition_type in COMPOSITE_CONDITIONS:
+                try:
+                    predicates = self.body_predicates if condition_reads_body(rule) else self.header_predicates
+                    predicates.append((index, compile_condition(rule)[1]))
+                    self.rule_stage[index] = ('rule', index)
+                except (re.error, ValueError) as e:
+                    print(f"Error compiling rule {rule.get('name')}: {e}")
+        self.automata = {field: PatternAutomaton(patterns[field]) for field in self.FIELDS if patterns[field]}
+        # Subject templates fold digits, so a rule that looks for particular digits in the
+        # subject could tell two messages with the same template apart
+        self.template_safe = not any(condition_reads_subject_digits(rule) for rule in self.rules)
+        self.signature = zlib.crc32(json.dumps(self.rules, sort_keys=True).encode('utf-8'))
+
+    def stage_sizes(self):
+        sizes = defaultdict(int)
+        for stage in self.rule_stage.values():
+            sizes[stage] += 1
+        return sizes
+
+    def rule_costs(self, timings):
+        # [evaluations, seconds] per rule index. Time spent in a shared stage (an automaton,
+        # the domain hash) is split across the rules it serves
+        sizes = self.stage_sizes()
+        costs = {}
+        for index, stage in self.rule_stage.items():
+            runs, seconds = timings.get(stage, (0, 0.0))
+            seconds /= sizes[stage]
+            if stage != ('rule', index) and ('rule', index) in timings:
+                # Evaluated on its own as well, e.g. by a server-side SEARCH
+                runs += timings[('rule', index)][0]
+                seconds += timings[('rule', index)][1]
+            costs[index] = [runs, seconds]
+        return costs
+
+    def first_match(self, email_message, start=0, timings=None):
+        index = self.match_index(email_message, start, timings)
+        return self.rules[index] if index is not None else None
+
+    def match_index(self, email_message, start=0, timings=None):
+        # timings, when given, collects [runs, seconds] per evaluation stage
+        view = MessageView.of(email_message)
+        best = None
+        started = [time.perf_counter()]
+
+        def lap(stage):
+            if timings is not None:
+                now = time.perf_counter()
+                timings[stage][0] += 1
+                timings[stage][1] += now - started[0]
+                started[0] = now
+
+        if self.domains:
+            indices = self.domains.get(sender_domain(view), ())
+            position = bisect.bisect_left(indices, start)
+            if position < len(indices):
+                best = indices[position]
+            lap('domain')
+
+        def scan(field):
+            nonlocal best
+            automaton = self.automata.get(field)
+            if automaton is None or (best is not None and automaton.min_value > best):
+                return
+            text = view.body_lower if field == 'body' else view.header_lower(field)
+            hits = [index for index in automaton.search(text) if index >= start]
+            if hits:
+                best = min(hits) if best is None else min(best, *hits)
+            lap(field)
+
+        def evaluate(predicates):
+            # One at a time, in rule order, and only while they could still beat best
+            nonlocal best
+            for index, predicate in predicates:
+                if index < start:
+                    continue
+                if best is not None and index > best:
+                    break
+                matched = predicate(view)
+                lap(('rule', index))
+                if matched:
+                    best = index
+                    break
+
+        # Every header check comes first; the body is only decoded if a body rule could still win
+        scan('from')
+        scan('subject')
+        evaluate(self.header_predicates)
+        scan('body')
+        evaluate(self.body_predicates)
+        return best
+
+
+# Identifies a rule in rule_stats.json; editing a rule starts its statistics afresh
+def rule_key(rule):
+    return json.dumps(rule, sort_keys=True)
+
+
+# Moving a rule past another can only change a result if one message can match both and they
+# file it into different folders. Two domain rules never share a message unless they share a domain
+def rules_conflict(first, second):
+    if first.get('folder') == second.get('folder'):
+        return False
+    if first.get('condition_type') == 'domain' and second.get('condition_type') == 'domain':
+        return bool(rule_domains(str(first.get('condition_value', ''))) &
+                    rule_domains(str(second.get('condition_value', ''))))
+    return True
+
+
+# Identifies one version of a file; an atomic replace always gives it a new inode
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+# Readers see either the old file or the new one, never a half-written file
+def write_json_atomic(path, data):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                     prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class RuleStats:
+    # Hits, evaluations, evaluation time and last hit per rule, kept in rule_stats.json
+    def __init__(self, path='rule_stats.json'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stats = {}
+        try:
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    self.stats = json.load(f)
+        except Exception as e:
+            print(f"Error loading rule statistics: {e}")
+
+    def get(self, rule):
+        with self.lock:
+            return dict(self.stats.get(rule_key(rule), {"hits": 0, "evaluations": 0, "seconds": 0.0, "last_hit": None}))
+
+    def hit_rate(self, rule):
+        entry = self.get(rule)
+        return entry['hits'] / entry['evaluations'] if entry['evaluations'] else 0.0
+
+    def record(self, rule_set, timings, hits):
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.lock:
+            for index, (runs, seconds) in rule_set.rule_costs(timings).items():
+                if not runs and not hits.get(index):
+                    continue
+                entry = self.stats.setdefault(rule_key(rule_set.rules[index]),
+                                              {"hits": 0, "evaluations": 0, "seconds": 0.0, "last_hit": None})
+                entry['evaluations'] += runs
+                entry['seconds'] += seconds
+                if hits.get(index):
+                    entry['hits'] += hits[index]
+                    entry['last_hit'] = now
+
+    def save(self):
+        try:
+            with self.lock:
+                # Saved after every processing run; a crash mid-write must not lose the history
+                write_json_atomic(self.path, self.stats)
+        except Exception as e:
+            print(f"Error saving rule statistics: {e}")
+
+
+class NaiveBayesClassifier:
+    # Multinomial Naive Bayes over hashed bag-of-words features, kept in classifier.npz.
+    # Scoring takes a whole batch of messages and runs as a few NumPy operations
+    def __init__(self, path='classifier.npz', categories=CLASSIFIER_CATEGORIES, dimensions=CLASSIFIER_DIMENSIONS):
+        self.path = path
+        self.categories = list(categories)
+        self.dimensions = dimensions
+        self.feature_counts = np.zeros((len(self.categories), dimensions), dtype=np.float32)
+        self.document_counts = np.zeros(len(self.categories))
+        self.weights = None
+        self.revision = 0
+        try:
+            if os.path.exists(path):
+                with np.load(path) as data:
+                    self.categories = [str(category) for category in data['categories']]
+                    self.feature_counts = data['feature_counts']
+                    self.document_counts = data['document_counts']
+                    self.dimensions = self.feature_counts.shape[1]
+        except Exception as e:
+            print(f"Error loading classifier: {e}")
+
+    def features(self, email_message):
+        # Subject words, the sender's domain and the start of the body; digits are folded
+        # to 0 so every six-digit code looks alike
+        view = MessageView.of(email_message)
+        tokens = ['s:' + token for token in CLASSIFIER_TOKEN.findall(view.header_lower('subject'))]
+        tokens.append('d:' + sender_domain(view))
+        tokens += CLASSIFIER_TOKEN.findall(view.body_lower[:CLASSIFIER_BODY_CHARS])
+        hashed = [zlib.crc32(re.sub(r'\d', '0', token).encode('utf-8')) % self.dimensions for token in tokens]
+        indices, counts = np.unique(np.array(hashed, dtype=np.int64), return_counts=True)
+        return indices, counts.astype(np.float32)
+
+    @property
+    def trained(self):
+        return np.count_nonzero(self.document_counts) >= 2
+
+    def fit(self, samples):
+        # samples are (category, features); the category folders are the truth, so start over
+        self.feature_counts = np.zeros((len(self.categories), self.dimensions), dtype=np.float32)
+        self.document_counts = np.zeros(len(self.categories))
+        for category, (indices, counts) in samples:
+            row = self.categories.index(category)
+            self.feature_counts[row, indices] += counts
+            self.document_counts[row] += 1
+        self.weights = None
+        self.revision += 1
+        return self.trained
+
+    def log_weights(self):
+        if self.weights is None:
+            # Laplace smoothing; categories without training mail can never be predicted
+            totals = self.feature_counts.sum(axis=1, keepdims=True)
+            likelihoods = np.log((self.feature_counts + 1.0) / (totals + self.dimensions))
+            with np.errstate(divide='ignore'):
+                priors = np.log(self.document_counts / max(self.document_counts.sum(), 1))
+            self.weights = (likelihoods, priors)
+        return self.weights
+
+    def predict(self, rows):
+        # rows are features() results; returns (category, posterior probability) per row
+        if not rows or not self.trained:
+            return []
+        likelihoods, priors = self.log_weights()
+        lengths = [len(indices) for indices, _ in rows]
+        indices = np.concatenate([indices for indices, _ in rows])
+        counts = np.concatenate([counts for _, counts in rows])
+        documents = np.repeat(np.arange(len(rows)), lengths)
+        scores = np.empty((len(rows), len(self.categories)))
+        for column in range(len(self.categories)):
+            scores[:, column] = np.bincount(documents, weights=likelihoods[column, indices] * counts,
+                                            minlength=len(rows)) + priors[column]
+        scores -= scores.max(axis=1, keepdims=True)
+        probabilities = np.exp(scores)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        best = probabilities.argmax(axis=1)
+        return [(self.categories[column], float(probabilities[row, column])) for row, column in enumerate(best)]
+
+    def save(self):
+        try:
+            np.savez_compressed(self.path, categories=np.array(self.categories),
+                                feature_counts=self.feature_counts, document_counts=self.document_counts)
+        except Exception as e:
+            print(f"Error saving classifier: {e}")
+
+
+class RuleRun:
+    # One pass of the rule engine over a stream of messages: template cache, then the compiled
+    # rules, then the classifier for whatever is left, scored in batches by flush()
+    def __init__(self, organizer, start=0, timings=None, hits=None, template_cache=None, batch_size=5000,
+                 rule_set=None):
+        self.rule_set = rule_set or organizer.rule_set()
+        self.classifier = organizer.classifier
+        self.start = start
+        self.timings = timings if timings is not None else defaultdict(lambda: [0, 0.0])
+        self.hits = hits if hits is not None else defaultdict(int)
+        self.classify = organizer.app_settings['classifier_fallback'] and organizer.classifier.trained
+        self.threshold = float(organizer.app_settings['classifier_threshold'])
+        self.template_cache = template_cache or organizer.template_cache
+        self.template_cache.bind((self.rule_set.signature, start, self.classify, self.threshold, self.classifier.revision))
+        self.batch_size = batch_size
+        self.unmatched = []
+
+    def decide(self, key, email_message):
+        # Returns [(key, folder, rule index)] for whatever got decided, including any classifier batch
+        view = MessageView.of(email_message)
+        fingerprint = message_fingerprint(view) if self.rule_set.template_safe else None
+        cached, decision = self.template_cache.get(fingerprint) if fingerprint else (False, None)
+        if cached:
+            index, folder = decision
+            if index is not None:
+                self.hits[index] += 1
+            return [(key, folder, index)]
+
+        index = self.rule_set.match_index(view, self.start, self.timings)
+        # Only decisions reached from the headers alone hold for the whole template. match_index
+        # decodes the body only once every header check has had its turn, so this drops just those
+        # decisions a body rule could have changed
+        if view.body_decoded:
+            fingerprint = None
+        if index is None and self.classify:
+            self.unmatched.append((key, self.classifier.features(view), fingerprint))
+            return self.flush() if len(self.unmatched) >= self.batch_size else []
+
+        folder = self.rule_set.rules[index]['folder'] if index is not None else None
+        if index is not None:
+            self.hits[index] += 1
+        if fingerprint:
+            self.template_cache.put(fingerprint, (index, folder))
+        return [(key, folder, index)]
+
+    def flush(self):
+        decided = []
+        predictions = self.classifier.predict([features for _, features, _ in self.unmatched])
+        for (key, _, fingerprint), (category, confidence) in zip(self.unmatched, predictions):
+            folder = category if confidence >= self.threshold else None
+            if fingerprint:
+                self.template_cache.put(fingerprint, (None, folder))
+            decided.append((key, folder, None))
+        self.unmatched = []
+        return decided
+
+
+def open_mail_archive(path):
+    # A directory is read as a Maildir (cur/new/tmp), a file as mbox; neither is ever modified
+    if os.path.isdir(path):
+        return mailbox.Maildir(path, factory=None, create=False)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No such mbox file or Maildir: {path}")
+    return mailbox.mbox(path, create=False)
+
+
 class EmailOrganizer:
     def __init__(self):
         self.imap_server = None
+        self.connection_pool = None
+        self.selected_folder = None
+        self.processing_lock = threading.Lock()
+        self.imap_host = None
         self.email_address = None
         self.password = None
+        self.smtp_session = None
         self.rules = []
+        self.rules_lock = threading.RLock()
+        self.rules_stamp = None
+        self.compiled_rules = None
+        self.compiled_source = None
+        self.compiled_order = None
+        self.rule_conflicts = []
+        self.rule_stats = RuleStats()
+        self.app_settings = self.load_app_settings()
         self.load_rules()
         self.auto_reply_settings = self.load_auto_reply_settings()
+        self.fetch_batch_size = int(self.app_settings['fetch_batch_size'])
+        self.header_cache = HeaderCache()
+        self.analytics_rollups = AnalyticsRollups()
+        self.cached_uidvalidity = None
+        self.search_index = SearchIndex()
+        self.classifier = NaiveBayesClassifier()
+        self.template_cache = TemplateCache(int(self.app_settings['template_cache_size']))
+        self.outbound_spool = OutboundSpool()
+        self.recent_replies = RecentReplies()
+        self.reply_sender = AutoReplySender(self)
 
     def load_rules(self):
+        with self.rules_lock:
+            self.rules_stamp = file_stamp('email_rules.json')
+            try:
+                if self.rules_stamp:
+                    with open('email_rules.json', 'r') as f:
+                        self.rules = json.load(f)
+                else:
+                    self.rules = []
+            except Exception as e:
+                print(f"Error loading rules: {e}")
+                self.rules = []
+            self.rule_set()
+
+    def reload_rules(self):
+        # Picks up edits made to email_rules.json outside this process. Runs that already hold a
+        # compiled rule set finish with it; a file that fails to parse keeps the current rules
+        stamp = file_stamp('email_rules.json')
+        if stamp == self.rules_stamp:
+            return False
         try:
-            if os.path.exists('email_rules.json'):
+            if stamp:
                 with open('email_rules.json', 'r') as f:
-                    self.rules = json.load(f)
+                    rules = json.load(f)
+                if not isinstance(rules, list):
+                    raise ValueError("expected a list of rules")
             else:
-                self.rules = []
+                rules = []
         except Exception as e:
-            print(f"Error loading rules: {e}")
-            self.rules = []
+            print(f"Error reloading rules: {e}")
+            # Not retried until the file changes again
+            self.rules_stamp = stamp
+            return False
+        with self.rules_lock:
+            self.rules = rules
+            self.rules_stamp = stamp
+            self.rule_set()
+        return True
+
+    def add_rule(self, rule):
+        # Returns an error message, or None once the rule is saved and compiled in
+        if rule['condition_type'] in REGEX_CONDITIONS:
+            try:
+                re.compile(rule['condition_value'])
+            except re.error as e:
+                return f"Invalid regular expression: {e}"
+        elif rule['condition_type'] == 'domain' and not rule_domains(rule['condition_value']):
+            return "Enter at least one domain"
+        with self.rules_lock:
+            # Build on the file as it is now, not on a copy someone else has since replaced
+            self.reload_rules()
+            self.rules = self.rules + [rule]
+            self.save_rules()
+            self.rule_set()
+        return None
+
+    def rule_set(self):
+        # Recompiled whenever the rule list changed (including in-place edits from the GUI) or,
+        # in adaptive mode, when the hit statistics favour a different order
+        with self.rules_lock:
+            if self.compiled_source != self.rules:
+                self.compiled_source = [dict(rule) for rule in self.rules]
+                self.rule_conflicts = [[later for later in range(index + 1, len(self.rules))
+                                        if rules_conflict(rule, self.rules[later])]
+                                       for index, rule in enumerate(self.rules)]
+                self.compiled_order = None
+            order = self.adaptive_order() if self.app_settings['adaptive_rule_order'] else list(range(len(self.rules)))
+            if order != self.compiled_order:
+                self.compiled_order = order
+                self.compiled_rules = CompiledRuleSet([self.rules[index] for index in order])
+            return self.compiled_rules
+
+    def adaptive_order(self):
+        # Highest hit rate first, but never ahead of an earlier rule it conflicts with
+        blockers = [0] * len(self.rules)
+        for later_rules in self.rule_conflicts:
+            for later in later_rules:
+                blockers[later] += 1
+        ready = [(-self.rule_stats.hit_rate(rule), index) for index, rule in enumerate(self.rules) if not blockers[index]]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            _, index = heapq.heappop(ready)
+            order.append(index)
+            for later in self.rule_conflicts[index]:
+                blockers[later] -= 1
+                if not blockers[later]:
+                    heapq.heappush(ready, (-self.rule_stats.hit_rate(self.rules[later]), later))
+        return order
 
     def save_rules(self):
         try:
-            with open('email_rules.json', 'w') as f:
-                json.dump(self.rules, f, indent=2)
+            with self.rules_lock:
+                write_json_atomic('email_rules.json', self.rules)
+                self.rules_stamp = file_stamp('email_rules.json')
         except Exception as e:
             print(f"Error saving rules: {e}")
 
     def load_auto_reply_settings(self):
+        settings = {"enabled": False, "message": "", "rate_per_minute": 20, "reply_window_hours": 24}
         try:
             if os.path.exists('auto_reply_settings.json'):
                 with open('auto_reply_settings.json', 'r') as f:
-                    return json.load(f)
-            else:
-                return {"enabled": False, "message": ""}
+                    settings.update(json.load(f))
         except Exception as e:
             print(f"Error loading auto-reply settings: {e}")
-            return {"enabled": False, "message": ""}
+        return settings
 
     def save_auto_reply_settings(self, settings):
         try:
             with open('auto_reply_settings.json', 'w') as f:
                 json.dump(settings, f, indent=2)
+            self.auto_reply_settings = settings
+            self.reply_sender.wake()
         except Exception as e:
             print(f"Error saving auto-reply settings: {e}")
 
+    def load_app_settings(self):
+        settings = {"imap_server": "imap.gmail.com", "analysis_period": 30, "fetch_batch_size": 500,
+                    "connection_pool_size": 4, "mail_engine": "blocking", "server_side_rules": False,
+                    "adaptive_rule_order": False, "classifier_fallback": False, "classifier_threshold": 0.9,
+                    "template_cache_size": 10000, "smtp_server": "smtp.gmail.com", "smtp_port": 587,
+                    "analytics_sketch_capacity": 0}
+        try:
+            if os.path.exists('app_settings.json'):
+                with open('app_settings.json', 'r') as f:
+                    settings.update(json.load(f))
+        except Exception as e:
+            print(f"Error loading app settings: {e}")
+        return settings
+
+    def save_app_settings(self, settings):
+        try:
+            with open('app_settings.json', 'w') as f:
+                json.dump(settings, f, indent=2)
+            self.app_settings = settings
+            self.fetch_batch_size = int(settings['fetch_batch_size'])
+        except Exception as e:
+            print(f"Error saving app settings: {e}")
+
     def connect(self, email_address, password, imap_server="imap.gmail.com"):
         try:
-            self.imap_server = imaplib.IMAP4_SSL(imap_server)
+            if self.app_settings['mail_engine'] == 'asyncio':
+                self.imap_server = SyncIMAPFacade(AsyncEngine.shared(), imap_server)
+            else:
+                self.imap_server = imaplib.IMAP4_SSL(imap_server)
             self.imap_server.login(email_address, password)
+            if not isinstance(self.imap_server, SyncIMAPFacade):
+                # imaplib keeps the pre-login CAPABILITY; Gmail and Dovecot only list MOVE and
+                # UIDPLUS once authenticated, and move_messages decides by them
+                typ, data = self.imap_server.capability()
+                if typ == 'OK' and data and data[-1]:
+                    self.imap_server.capabilities = tuple(data[-1].decode('ascii', 'replace').upper().split())
+            self.close_smtp()
+            self.imap_host = imap_server
             self.email_address = email_address
             self.password = password
+            if self.connection_pool:
+                self.connection_pool.close()
+            self.connection_pool = None
+            pool_size = int(self.app_settings['connection_pool_size'])
+            # The asyncio engine pipelines batches on one session instead of opening more
+            if pool_size > 1 and self.app_settings['mail_engine'] != 'asyncio':
+                # Extra sessions are opened lazily by the first parallel fetch
+                self.connection_pool = IMAPConnectionPool(imap_server, email_address, password, pool_size)
+            # Replies left in the spool by an earlier session go out now
+            self.reply_sender.start()
             return True
         except Exception as e:
             print(f"Connection error: {e}")
             return False
 
-    def analyze_emails(self, days=30):
+    def fetch_batches(self, nums, query, uid=False, connection=None):
+        # One FETCH round trip per sequence set instead of one per message
+        connection = connection or self.imap_server
+        sequence_sets = build_sequence_sets(nums, self.fetch_batch_size)
+        if (uid and self.connection_pool and connection is self.imap_server and len(sequence_sets) > 1
+                and not FETCH_SETS_SEEN.search(query)):
+            # UIDs mean the same thing on every session, so batches can run in parallel; pool
+            # sessions are EXAMINEd, so fetches that should set \Seen stay on the main one
+            yield from self.connection_pool.run(
+                self.selected_folder,
+                lambda connection, sequence_set: fetch_sequence_set(connection, sequence_set, query, uid=True),
+                sequence_sets)
+            return
+        if hasattr(connection, 'fetch_pipelined') and len(sequence_sets) > 1:
+            for sequence_set, (typ, data) in connection.fetch_pipelined(sequence_sets, query, uid):
+                yield collect_fetch_response(typ, data, sequence_set, uid)
+            return
+        for sequence_set in sequence_sets:
+            yield fetch_sequence_set(connection, sequence_set, query, uid)
+
+    def fetch_messages(self, nums, query='(RFC822)', uid=False, connection=None):
+        for fetched in self.fetch_batches(nums, query, uid, connection):
+            for num, _, literals in fetched:
+                email_body = literals[0][1]
+                yield num, email_body, email.message_from_bytes(email_body)
+
+    def fetch_message_headers(self, nums, fields=ANALYTICS_HEADER_FIELDS, uid=False, connection=None):
+        # Only the requested headers plus size and MIME structure; PEEK leaves \Seen untouched
+        query = f'(UID RFC822.SIZE BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({" ".join(fields)})])'
+        for fetched in self.fetch_batches(nums, query, uid, connection):
+            for num, meta, literals in fetched:
+                header_bytes = next((lit for name, lit in literals if b'HEADER' in name), literals[-1][1])
+                size_match = FETCH_RFC822_SIZE.search(meta)
+                structure_pos = meta.upper().find(b'BODYSTRUCTURE (')
+                structure = parse_imap_list(meta, structure_pos + len(b'BODYSTRUCTURE'))[0] if structure_pos >= 0 else None
+                yield (num, int(size_match.group(1)) if size_match else 0,
+                       email.message_from_bytes(header_bytes), bodystructure_attachment_types(structure))
+
+    def select_folder(self, folder='INBOX'):
+        typ, data = self.imap_server.select(folder if folder == 'INBOX' else imap_quote(folder))
+        if typ != 'OK':
+            raise imaplib.IMAP4.error(f"SELECT {folder} failed: {data}")
+        self.selected_folder = folder
+        _, uidvalidity = self.imap_server.response('UIDVALIDITY')
+        return int(uidvalidity[0]) if uidvalidity and uidvalidity[0] else 0
+
+    def cached_headers(self, criteria, folder='INBOX', job=None, dates_only=False):
+        # A single UID SEARCH decides membership; only UIDs never seen before are fetched.
+        # dates_only returns just uid and date for each message
+        uidvalidity = self.select_folder(folder)
+        self.cached_uidvalidity = uidvalidity
+        _, data = self.imap_server.uid('SEARCH', None, criteria)
+        uids = sorted(int(uid) for uid in data[0].split()) if data and data[0] else []
+
+        self.header_cache.drop_stale(self.email_address, folder, uidvalidity)
+        records = (self.header_cache.dates if dates_only else self.header_cache.get)(
+            self.email_address, folder, uidvalidity, uids)
+        missing = [uid for uid in uids if uid not in records]
+        if job and records:
+            job.partial(list(records.values()))
+        if missing:
+            fetched = []
+            for uid, size, header_message, attachment_exts in self.fetch_message_headers(missing, uid=True):
+                fetched.append(header_record(int(uid), size, header_message, attachment_exts))
+                if job and len(fetched) % self.fetch_batch_size == 0:
+                    job.partial(fetched[-self.fetch_batch_size:])
+                    job.progress(f"Fetched {len(fetched)} of {len(missing)} new headers")
+                    if job.cancelled.is_set():
+                        break
+            # Whatever arrived before a cancel is cached, so the next run resumes from there
+            self.header_cache.put(self.email_address, folder, uidvalidity, fetched)
+            # Headers become searchable right away; sync_search_index adds the bodies later
+            self.search_index.drop_stale(self.email_address, folder, uidvalidity)
+            self.search_index.add(self.email_address, folder, uidvalidity,
+                                  [dict(record, subject=decode_header_text(record['subject']), body=None)
+                                   for record in fetched])
+            records.update((record['uid'], record) for record in fetched)
+            if job:
+                job.check()
+                if len(fetched) % self.fetch_batch_size:
+                    job.partial(fetched[len(fetched) // self.fetch_batch_size * self.fetch_batch_size:])
+        return [records[uid] for uid in uids if uid in records]
+
+    def list_folders(self, include_all_mail=True):
+        typ, data = self.imap_server.list()
+        if typ != 'OK':
+            raise imaplib.IMAP4.error(f"LIST failed: {data}")
+        folders = []
+        for line in data:
+            if isinstance(line, tuple):
+                # Folder names with unusual characters arrive as a literal
+                flags, _ = parse_imap_list(b'(' + line[0] + b')')
+                folders.append((flags[0], line[1].decode('utf-8', 'replace')))
+            elif line:
+                flags, _ = parse_imap_list(b'(' + line + b')')
+                folders.append((flags[0], flags[-1]))
+        # RFC 6154 \All (Gmail's "All Mail") holds a second copy of every message in the other folders
+        skipped = {'\\noselect'} if include_all_mail else {'\\noselect', '\\all'}
+        return [name for flags, name in folders
+                if name and not any(flag.lower() in skipped for flag in flags or [] if flag)]
+
+    def sync_search_index(self, folders=None, job=None):
+        # Download and index every message body not indexed yet; later runs only fetch new mail
+        # and forget messages that are gone from the server
+        if not self.imap_server:
+            return "Not connected to email server"
+
+        try:
+            indexed = 0
+            if not folders:
+                folders = self.list_folders(include_all_mail=False)
+                # Folders deleted since, or indexed before All Mail was left out
+                for folder in self.search_index.synced_folders(self.email_address) - set(folders):
+                    self.search_index.drop_folder(self.email_address, folder)
+            for folder in folders:
+                if job:
+                    job.check()
+                    job.progress(f"Indexing {folder}...")
+                uidvalidity = self.select_folder(folder)
+                self.search_index.drop_stale(self.email_address, folder, uidvalidity)
+                _, data = self.imap_server.uid('SEARCH', None, 'ALL')
+                uids = [int(uid) for uid in data[0].split()] if data and data[0] else []
+                self.search_index.prune(self.email_address, folder, uidvalidity, uids)
+                done = self.search_index.indexed_uids(self.email_address, folder, uidvalidity)
+                missing = [uid for uid in uids if uid not in done]
+
+                entries = []
+                for uid, email_body, email_message in self.fetch_messages(missing, '(BODY.PEEK[])', uid=True):
+                    entries.append(index_entry(int(uid), email_message))
+                    # Commit per batch so an interrupted sync resumes where it stopped
+                    if len(entries) >= self.fetch_batch_size:
+                        self.search_index.add(self.email_address, folder, uidvalidity, entries)
+                        indexed += len(entries)
+                        entries = []
+                        if job:
+                            job.check()
+                            job.progress(f"Indexing {folder}: {indexed} emails so far")
+                self.search_index.add(self.email_address, folder, uidvalidity, entries)
+                indexed += len(entries)
+                self.search_index.mark_synced(self.email_address, folder, uidvalidity)
+            return f"Indexed {indexed} emails"
+        except Exception as e:
+            return f"Error indexing emails: {str(e)}"
+
+    def refresh_search_index(self, job=None):
+        # Run in the background after processing and new mail, so searches never wait on the server
+        if not self.imap_server or not self.search_index.is_synced(self.email_address):
+            return None
+        return self.sync_search_index(job=job)
+
+    def train_classifier(self, per_folder=500, job=None):
+        # Learn each category from the most recent mail already filed in the folder of that name
+        if not self.imap_server:
+            return "Not connected to email server"
+
+        try:
+            available = set(self.list_folders())
+            samples = []
+            folders = 0
+            for category in self.classifier.categories:
+                if category not in available:
+                    continue
+                if job:
+                    job.check()
+                    job.progress(f"Learning from {category}...")
+                self.select_folder(category)
+                _, data = self.imap_server.uid('SEARCH', None, 'ALL')
+                uids = [int(uid) for uid in data[0].split()][-per_folder:] if data and data[0] else []
+                for uid, email_body, email_message in self.fetch_messages(uids, '(BODY.PEEK[])', uid=True):
+                    samples.append((category, self.classifier.features(email_message)))
+                folders += 1 if uids else 0
+            if not self.classifier.fit(samples):
+                return "Error training classifier: at least two category folders must contain mail"
+            self.classifier.save()
+            return f"Trained classifier on {len(samples)} emails from {folders} folders"
+        except Exception as e:
+            return f"Error training classifier: {str(e)}"
+
+    def analyze_emails(self, days=30, job=None):
         if not self.imap_server:
             return "Not connected to email server"
 
         try:
-            self.imap_server.select('INBOX')
             date = (datetime.now() - timedelta(days=days)).strftime("%d-%b-%Y")
-            _, messages = self.imap_server.search(None, f'(SINCE "{date}")')
-
-            analytics = {
-                'total_emails': 0,
-                'sender_frequency': defaultdict(int),
-                'hourly_distribution': defaultdict(int),
-                'average_response_time': 0,
-                'subject_keywords': defaultdict(int),
-                'email_sizes': [],
-                'attachment_types': defaultdict(int)
-            }
+            dated = self.cached_headers(f'(SINCE "{date}")', job=job, dates_only=True)
+            uidvalidity = self.cached_uidvalidity
+
+            # Group UIDs by local day as columns; records arrive in UID order and the sort is stable
+            uids = np.array([record['uid'] for record in dated], dtype=np.int64)
+            day_names, day_index, hours = local_days_and_hours(
+                [record['date'] if record['date'] is not None else np.nan for record in dated])
+            order = np.argsort(day_index, kind='stable')
+            day_positions = {}
+            for group in np.split(order, np.flatnonzero(np.diff(day_index[order])) + 1):
+                if len(group):
+                    day_positions[day_names[day_index[group[0]]] if day_index[group[0]] >= 0 else ''] = group
 
-            total_response_time = 0
-            response_count = 0
-            last_received_time = None
-
-            for num in messages[0].split():
-                _, msg_data = self.imap_server.fetch(num, '(RFC822)')
-                email_body = msg_data[0][1]
-                email_message = email.message_from_bytes(email_body)
-
-                analytics['total_emails'] += 1
-
-                sender = email.utils.parseaddr(email_message['From'])[1]
-                analytics['sender_frequency'][sender] += 1
-
-                date_tuple = email.utils.parsedate_tz(email_message['Date'])
-                if date_tuple:
-                    local_date = datetime.fromtimestamp(email.utils.mktime_tz(date_tuple))
-                    analytics['hourly_distribution'][local_date.hour] += 1
-
-                if email_message['In-Reply-To']:
-                    if last_received_time:
-                        response_time = (local_date - last_received_time).total_seconds() / 60
-                        total_response_time += response_time
-                        response_count += 1
-                last_received_time = local_date
-
-                subject = email_message['Subject']
-                if subject:
-                    words = subject.lower().split()
-                    for word in words:
-                        if len(word) > 3:
-                            analytics['subject_keywords'][word] += 1
-
-                # Email size
-                analytics['email_sizes'].append(len(email_body))
-
-                # Attachment types
-                if email_message.is_multipart():
-                    for part in email_message.walk():
-                        if part.get_content_maintype() == 'multipart':
-                            continue
-                        if part.get('Content-Disposition') is None:
-                            continue
-                        file_name = part.get_filename()
-                        if file_name:
-                            file_ext = os.path.splitext(file_name)[1].lower()
-                            analytics['attachment_types'][file_ext] += 1
-
-            if response_count > 0:
-                analytics['average_response_time'] = total_response_time / response_count
+            # Days whose messages are unchanged since their rollup was stored are not re-read. Each
+            # day is loaded or rebuilt only as merge_rollups reaches it, so one day is in memory at a time
+            sketch_capacity = int(self.app_settings['analytics_sketch_capacity'])
+            binned = bool(sketch_capacity)
+            stored = self.analytics_rollups.signatures(self.email_address, 'INBOX')
+
+            def rollups():
+                for day in sorted(day_positions):
+                    day_uids = uids[day_positions[day]].tolist()
+                    signature = rollup_signature(uidvalidity, day_uids, binned)
+                    rollup = self.analytics_rollups.get(self.email_address, 'INBOX', day) if stored.get(day) == signature else None
+                    if rollup is None:
+                        records = self.header_cache.get(self.email_address, 'INBOX', uidvalidity, day_uids)
+                        positions = [position for position in day_positions[day] if int(uids[position]) in records]
+                        rollup = day_rollup([records[int(uids[position])] for position in positions], hours[positions],
+                                            binned)
+                        self.analytics_rollups.put(self.email_address, 'INBOX', [(day, signature, rollup)])
+                    yield day, rollup
+
+            analytics = merge_rollups(rollups(), sketch_capacity)
 
             # Store the last analytics for theme switching
             self.last_analytics = analytics
@@ -150,36 +2571,220 @@ class EmailOrganizer:
         except Exception as e:
             return f"Error analyzing emails: {str(e)}"
 
-    def process_emails(self):
+    def process_emails(self, job=None):
         if not self.imap_server:
             return "Not connected to email server"
 
         try:
-            self.imap_server.select('INBOX')
-            _, messages = self.imap_server.search(None, 'UNSEEN')
-
-            processed = 0
-            for msg_num in messages[0].split():
-                _, msg_data = self.imap_server.fetch(msg_num, '(RFC822)')
-                email_body = msg_data[0][1]
-                email_message = email.message_from_bytes(email_body)
-
-                for rule in self.rules:
-                    if self.match_rule(email_message, rule):
-                        self.imap_server.copy(msg_num, rule['folder'])
-                        self.imap_server.store(msg_num, '+FLAGS', '\\Deleted')
-                        processed += 1
+            self.select_folder('INBOX')
+            _, messages = self.imap_server.uid('SEARCH', None, 'UNSEEN')
+            processed = self.process_uids(messages[0].split() if messages and messages[0] else [], job=job)
+            return f"Processed {processed} emails"
+
+        except Exception as e:
+            return f"Error processing emails: {str(e)}"
+
+    def process_uids(self, uids, connection=None, query='(RFC822)', job=None):
+        # Shared by the Process button and the IDLE watcher, which must not overlap
+        connection = connection or self.imap_server
+        with self.processing_lock:
+            moves = defaultdict(list)
+            # Checked once per batch; this batch then runs on one compiled snapshot throughout
+            self.reload_rules()
+            rule_set = self.rule_set()
+            timings = defaultdict(lambda: [0, 0.0])
+            hits = defaultdict(int)
+            remaining, start = list(uids), 0
+            if self.app_settings['server_side_rules']:
+                remaining, start = self.match_rules_on_server(uids, moves, connection, timings, hits, rule_set)
+                if 'PEEK' not in query:
+                    # A full fetch would have set \Seen; keep "processed means read" without downloading
+                    for sequence_set in build_sequence_sets(uids, self.fetch_batch_size):
+                        connection.uid('STORE', sequence_set, '+FLAGS.SILENT', '(\\Seen)')
+
+            # Messages no rule claimed go to the classifier together, as one batch
+            replies = []
+            run = RuleRun(self, start, timings, hits, batch_size=max(len(remaining), 1), rule_set=rule_set)
+            fetched = set()
+            if (start < len(rule_set.rules) or run.classify) and remaining:
+                for uid, email_body, email_message in self.fetch_messages(remaining, query, uid=True, connection=connection):
+                    # A cancel stops fetching, but what already matched is still moved below
+                    if job and job.cancelled.is_set():
                         break
+                    fetched.add(int(uid))
+                    if job and len(fetched) % 50 == 0:
+                        job.progress(f"Processed {len(fetched)} of {len(remaining)} emails")
+                    # Every rule and the auto-reply share one lazily decoded body
+                    view = MessageView(email_message)
+                    for decided_uid, folder, _ in run.decide(uid, view):
+                        if folder:
+                            moves[folder].append(decided_uid)
 
-                # Auto-reply functionality
-                if self.auto_reply_settings['enabled']:
-                    self.send_auto_reply(email_message)
+                    # Auto-replies are queued and sent together over one SMTP session
+                    if self.auto_reply_settings['enabled'] and auto_reply_allowed(view, self.email_address):
+                        replies.append(self.auto_reply_message(view))
 
-            self.imap_server.expunge()
-            return f"Processed {processed} emails"
+            # Auto-replies only need a few headers for messages the rules never downloaded
+            if self.auto_reply_settings['enabled'] and not (job and job.cancelled.is_set()):
+                unfetched = [uid for uid in uids if int(uid) not in fetched]
+                for _, _, header_message, _ in self.fetch_message_headers(
+                        unfetched, AUTO_REPLY_HEADER_FIELDS, uid=True, connection=connection):
+                    if auto_reply_allowed(header_message, self.email_address):
+                        replies.append(self.auto_reply_message(header_message))
+            if replies:
+                self.queue_auto_replies(replies)
+
+            for decided_uid, folder, _ in run.flush():
+                if folder:
+                    moves[folder].append(decided_uid)
+
+            self.move_messages(moves, connection)
+            self.rule_stats.record(rule_set, timings, hits)
+            self.rule_stats.save()
+            return sum(len(folder_uids) for folder_uids in moves.values())
 
+    def rule_search_criteria(self, rule):
+        # IMAP SEARCH does the same case-insensitive substring test as match_rule
+        if rule.get('condition_type') in COMPOSITE_CONDITIONS:
+            parts = [self.rule_search_criteria(condition) for condition in rule.get('conditions', [])]
+            if not parts or None in parts:
+                return None
+            if rule['condition_type'] == 'all':
+                return '(' + ' '.join(parts) + ')'
+            if rule['condition_type'] == 'not':
+                return f"NOT {parts[0]}" if len(parts) == 1 else None
+            # OR takes exactly two keys, so longer lists nest: OR a (OR b c)
+            criteria = parts[-1]
+            for part in reversed(parts[:-1]):
+                criteria = f"OR {part} {criteria}"
+            return criteria
+        key = {'from': 'FROM', 'subject': 'SUBJECT', 'body': 'BODY'}.get(rule.get('condition_type'))
+        value = rule.get('condition_value', '')
+        if not key or not value.isascii() or '\r' in value or '\n' in value:
+            return None
+        return f"{key} {imap_quote(value)}"
+
+    def simulate(self, path, limit=None, output=None, job=None):
+        # Dry run of the current rules over a local mbox/Maildir: nothing is moved, no auto-reply
+        # is sent and the live rule statistics and template cache are left alone
+        try:
+            archive = open_mail_archive(path)
         except Exception as e:
-            return f"Error processing emails: {str(e)}"
+            return f"Error opening {path}: {e}"
+
+        run = RuleRun(self, template_cache=TemplateCache(int(self.app_settings['template_cache_size'])))
+        counts = defaultdict(int)
+        headers = {}
+        writer = None
+        handle = None
+        if output:
+            handle = open(output, 'w', newline='', encoding='utf-8')
+            writer = csv.writer(handle)
+            writer.writerow(['message_id', 'from', 'subject', 'folder', 'rule'])
+
+        def record(decided):
+            for key, folder, index in decided:
+                counts[folder or 'INBOX'] += 1
+                if writer:
+                    message_id, sender, subject = headers.pop(key)
+                    rule = describe_condition(run.rule_set.rules[index]) if index is not None else (
+                        'classifier' if folder else '')
+                    writer.writerow([message_id, sender, subject, folder or 'INBOX', rule])
+
+        total = 0
+        engine_time = 0.0
+        started = time.perf_counter()
+        try:
+            for key, email_message in archive.iteritems():
+                if limit is not None and total >= limit:
+                    break
+                if job and job.cancelled.is_set():
+                    break
+                total += 1
+                if writer:
+                    headers[key] = (decode_header_text(email_message.get('Message-ID', '')),
+                                    decode_header_text(email_message.get('From', '')),
+                                    decode_header_text(email_message.get('Subject', '')))
+                # Archive parsing is timed separately so throughput reflects the rule engine
+                lap = time.perf_counter()
+                decided = run.decide(key, email_message)
+                engine_time += time.perf_counter() - lap
+                record(decided)
+                if job and total % 500 == 0:
+                    job.progress(f"Simulated {total} emails")
+            lap = time.perf_counter()
+            decided = run.flush()
+            engine_time += time.perf_counter() - lap
+            record(decided)
+        except Exception as e:
+            return f"Error reading {path}: {e}"
+        finally:
+            archive.close()
+            if handle:
+                handle.close()
+        elapsed = time.perf_counter() - started
+
+        rules = []
+        for index, (runs, seconds) in run.rule_set.rule_costs(run.timings).items():
+            rule = run.rule_set.rules[index]
+            rules.append({'rule': describe_condition(rule), 'folder': rule['folder'], 'hits': run.hits[index],
+                          'evaluations': runs, 'avg_us': seconds / runs * 1e6 if runs else 0.0,
+                          'total_ms': seconds * 1000})
+        rules.sort(key=lambda item: item['total_ms'], reverse=True)
+        return {'messages': total, 'folders': dict(counts), 'seconds': elapsed, 'engine_seconds': engine_time,
+                'messages_per_second': total / engine_time if engine_time else 0.0,
+                'template_hits': run.template_cache.hits, 'rules': rules}
+
+    def match_rules_on_server(self, uids, moves, connection=None, timings=None, hits=None, rule_set=None):
+        # Walk the rules in order with one UID SEARCH each, so first-match-wins still holds.
+        # Returns the UIDs left undecided and the index of the first rule that must run locally
+        connection = connection or self.imap_server
+        rules = (rule_set or self.rule_set()).rules
+        undecided = {int(uid) for uid in uids}
+        for index, rule in enumerate(rules):
+            if not undecided:
+                break
+            criteria = self.rule_search_criteria(rule)
+            if criteria is None:
+                return sorted(undecided), index
+            started = time.perf_counter()
+            typ, data = connection.uid('SEARCH', None, f'UNSEEN {criteria}')
+            if typ != 'OK':
+                raise imaplib.IMAP4.error(f"SEARCH for rule {rule.get('name')} failed: {data}")
+            matched = {int(uid) for uid in data[0].split()} & undecided if data and data[0] else set()
+            moves[rule['folder']].extend(str(uid) for uid in sorted(matched))
+            undecided -= matched
+            if timings is not None:
+                timings[('rule', index)][0] += 1
+                timings[('rule', index)][1] += time.perf_counter() - started
+            if hits is not None and matched:
+                hits[index] += len(matched)
+        return sorted(undecided), len(rules)
+
+    def move_messages(self, moves, connection=None, source_folder='INBOX'):
+        # One command per target folder (and sequence-set batch) instead of per message
+        connection = connection or self.imap_server
+        capabilities = {capability.upper() for capability in getattr(connection, 'capabilities', ())}
+        needs_expunge = False
+        for folder, uids in moves.items():
+            for sequence_set in build_sequence_sets(uids, self.fetch_batch_size):
+                if 'MOVE' in capabilities:
+                    # RFC 6851: atomic copy + delete + expunge of just these UIDs
+                    typ, data = connection.uid('MOVE', sequence_set, folder)
+                else:
+                    typ, data = connection.uid('COPY', sequence_set, folder)
+                    if typ == 'OK':
+                        typ, data = connection.uid('STORE', sequence_set, '+FLAGS.SILENT', '(\\Deleted)')
+                    if typ == 'OK' and 'UIDPLUS' in capabilities:
+                        typ, data = connection.uid('EXPUNGE', sequence_set)
+                    else:
+                        needs_expunge = True
+                if typ != 'OK':
+                    raise imaplib.IMAP4.error(f"Moving messages to {folder} failed: {data}")
+            # The target folder picks them up with new UIDs on its next sync
+            self.search_index.remove(self.email_address, source_folder, uids)
+        if needs_expunge:
+            connection.expunge()
 
     def match_rule(self, email_message, rule):
         if rule['condition_type'] == 'from':
@@ -188,61 +2793,81 @@ class EmailOrganizer:
             return rule['condition_value'].lower() in email_message['Subject'].lower()
         elif rule['condition_type'] == 'body':
             return self.check_body_content(email_message, rule['condition_value'])
+        elif rule['condition_type'] == 'domain':
+            return sender_domain(email_message) in rule_domains(rule['condition_value'])
+        elif rule['condition_type'] in REGEX_CONDITIONS or rule['condition_type'] in COMPOSITE_CONDITIONS:
+            return compile_condition(rule)[1](MessageView.of(email_message))
         return False
 
     def check_body_content(self, email_message, keyword):
-        if email_message.is_multipart():
-            for part in email_message.walk():
-                if part.get_content_type() == "text/plain":
-                    return keyword.lower() in part.get_payload().lower()
-        else:
-            return keyword.lower() in email_message.get_payload().lower()
+        return keyword.lower() in MessageView.of(email_message).body_lower
 
-    def send_auto_reply(self, email_message):
-        sender = email.utils.parseaddr(email_message['From'])[1]
-        subject = "Re: " + email_message['Subject']
+    def open_smtp(self, host, port):
+        if self.app_settings['mail_engine'] == 'asyncio':
+            return SyncSMTPFacade(AsyncEngine.shared(), host, port)
+        if port == 465:
+            return smtplib.SMTP_SSL(host, port, timeout=SMTP_TIMEOUT)
+        return smtplib.SMTP(host, port, timeout=SMTP_TIMEOUT)
+
+    def auto_reply_message(self, email_message):
+        sender = email.utils.parseaddr(str(email_message['From'] or ''))[1]
+        subject = "Re: " + str(email_message['Subject'] or '')
         body = self.auto_reply_settings['message']
 
         msg = MIMEText(body)
         msg['Subject'] = subject
         msg['From'] = self.email_address
         msg['To'] = sender
+        return msg
 
-        try:
-            with smtplib.SMTP('smtp.gmail.com', 587) as smtp:
-                smtp.starttls()
-                smtp.login(self.email_address, self.password)
-                smtp.send_message(msg)
-        except Exception as e:
-            print(f"Error sending auto-reply: {e}")
+    def queue_auto_replies(self, messages):
+        # Sent in the background by reply_sender, at the configured rate. One reply per sender
+        # per window, which also collapses repeats within this batch
+        window = float(self.auto_reply_settings['reply_window_hours']) * 3600
+        claimed = self.recent_replies.claim(self.email_address, [msg['To'] for msg in messages if msg['To']], window)
+        replies = []
+        for msg in messages:
+            sender = str(msg['To'] or '').lower()
+            if sender in claimed:
+                claimed.discard(sender)
+                replies.append(msg)
+        if replies:
+            self.outbound_spool.enqueue(self.email_address, replies)
+            self.reply_sender.start()
+        return len(replies)
 
-    def search_emails(self, query, days=30):
-        if not self.imap_server:
-            return "Not connected to email server"
+    def smtp(self):
+        # The session (TLS handshake and AUTH) is reused for every reply; it is replaced when
+        # the SMTP settings or the account change
+        host, port = self.app_settings['smtp_server'], int(self.app_settings['smtp_port'])
+        session = self.smtp_session
+        if not session or (session.host, session.port, session.email_address) != (host, port, self.email_address):
+            self.close_smtp()
+            session = self.smtp_session = SMTPSession(self, host, port)
+        return session
 
+    def close_smtp(self):
+        if self.smtp_session:
+            self.smtp_session.close()
+            self.smtp_session = None
+
+    def search_emails(self, query, days=30, job=None):
+        # days=None searches all time
         try:
-            self.imap_server.select('INBOX')
-            date = (datetime.now() - timedelta(days=days)).strftime("%d-%b-%Y")
-            search_criteria = f'(SINCE "{date}") SUBJECT "{query}"'
-            _, messages = self.imap_server.search(None, search_criteria)
-
-            results = []
-            for num in messages[0].split():
-                _, msg_data = self.imap_server.fetch(num, '(RFC822)')
-                email_body = msg_data[0][1]
-                email_message = email.message_from_bytes(email_body)
-
-                subject = email_message['Subject']
-                sender = email.utils.parseaddr(email_message['From'])[1]
-                date = email.utils.parsedate_to_datetime(email_message['Date'])
-
-                results.append({
-                    'subject': subject,
-                    'sender': sender,
-                    'date': date.strftime("%Y-%m-%d %H:%M:%S")
-                })
-
-            return results
+            if self.search_index.is_synced(self.email_address):
+                # Answered locally (subject, sender and body), so it also works offline
+                since = (datetime.now() - timedelta(days=days)).timestamp() if days else None
+                records = self.search_index.search(query, self.email_address, since)
+            elif not self.imap_server:
+                return "Not connected to email server"
+            else:
+                search_criteria = f'SUBJECT "{query}"'
+                if days:
+                    date = (datetime.now() - timedelta(days=days)).strftime("%d-%b-%Y")
+                    search_criteria = f'(SINCE "{date}") {search_criteria}'
+                records = self.cached_headers(search_criteria, job=job)
+
+            return [search_result(record) for record in records]
         except Exception as e:
             return f"Error searching emails: {str(e)}"
         
@@ -322,6 +2947,23 @@ class AnalyticsWindow:
         ttk.Label(response_stats, text="Avg Response Time", font=("Helvetica", 12, "bold")).pack(anchor="w")
         ttk.Label(response_stats, text=f"{average_response_time:.2f} min", font=("Helvetica", 20, "bold")).pack(anchor="w")
         
+        # Median and 90th percentile message size
+        size_percentiles = self.analytics.get('size_percentiles', {})
+        if size_percentiles:
+            size_frame = ttk.Frame(stats_frame)
+            size_frame.pack(side=tk.RIGHT, padx=20)
+
+            size_indicator = ttk.Frame(size_frame, width=15, height=40)
+            size_indicator.configure(style="Danger.TFrame")
+            size_indicator.pack(side=tk.LEFT, padx=(0, 10))
+
+            size_stats = ttk.Frame(size_frame)
+            size_stats.pack(side=tk.LEFT)
+
+            ttk.Label(size_stats, text="Size p50 / p90", font=("Helvetica", 12, "bold")).pack(anchor="w")
+            ttk.Label(size_stats, text=f"{size_percentiles[50] / 1024:.0f}K / {size_percentiles[90] / 1024:.0f}K",
+                      font=("Helvetica", 20, "bold")).pack(anchor="w")
+
         # Add a third stat if available (e.g., total senders)
         if sender_frequency:
             sender_frame = ttk.Frame(stats_frame)
@@ -335,7 +2977,9 @@ class AnalyticsWindow:
             sender_stats.pack(side=tk.LEFT)
             
             ttk.Label(sender_stats, text="Unique Senders", font=("Helvetica", 12, "bold")).pack(anchor="w")
-            ttk.Label(sender_stats, text=f"{len(sender_frequency)}", font=("Helvetica", 20, "bold")).pack(anchor="w")
+            # A sketch only holds its top senders, so the true number is at least this
+            unique_senders = f"{len(sender_frequency)}+" if self.analytics.get('sketched') else f"{len(sender_frequency)}"
+            ttk.Label(sender_stats, text=unique_senders, font=("Helvetica", 20, "bold")).pack(anchor="w")
 
         # Create tabs for different analytics views
         notebook = ttk.Notebook(main_frame)
@@ -389,15 +3033,15 @@ class AnalyticsWindow:
         plt.subplots_adjust(hspace=0.4, wspace=0.4)
         
         # Extract analytics data
-        hourly_distribution = self.analytics.get('hourly_distribution', {})
-        sender_frequency = self.analytics.get('sender_frequency', {})
-        email_sizes = self.analytics.get('email_sizes', [])
+        hourly_counts = self.analytics.get('hourly_counts', np.zeros(24, dtype=np.int64))
+        top_senders = self.analytics.get('top_senders', [])
+        size_histogram = self.analytics.get('size_histogram')
         subject_keywords = self.analytics.get('subject_keywords', {})
 
         # Hourly distribution
         ax1 = fig.add_subplot(221)
         hours = list(range(24))
-        counts = [hourly_distribution.get(hour, 0) for hour in hours]
+        counts = hourly_counts
         bars = ax1.bar(hours, counts, color='#5cb85c', alpha=0.7)
         ax1.set_xlabel('Hour of Day', fontsize=10)
         ax1.set_ylabel('Number of Emails', fontsize=10)
@@ -415,7 +3059,7 @@ class AnalyticsWindow:
 
         # Top senders
         ax2 = fig.add_subplot(222)
-        top_senders = sorted(sender_frequency.items(), key=lambda x: x[1], reverse=True)[:5]
+        top_senders = top_senders[:5]
         if top_senders:
             # Truncate long email addresses for better display
             senders = [s[0][:15] + '...' if len(s[0]) > 15 else s[0] for s in top_senders]
@@ -438,8 +3082,10 @@ class AnalyticsWindow:
 
         # Email size distribution
         ax3 = fig.add_subplot(223)
-        if email_sizes:
-            n, bins, patches = ax3.hist(email_sizes, bins=15, color='#d9534f', alpha=0.7)  # Fewer bins
+        if size_histogram is not None:
+            # Binned by merge_rollups; drawn from the bin counts rather than re-binning every size
+            size_counts, size_edges = size_histogram
+            n, bins, patches = ax3.hist(size_edges[:-1], bins=size_edges, weights=size_counts, color='#d9534f', alpha=0.7)
             ax3.set_xlabel('Email Size (KB)', fontsize=10)
             ax3.set_ylabel('Frequency', fontsize=10)
             ax3.set_title('Email Size Distribution', fontweight='bold', fontsize=12)
@@ -508,7 +3154,8 @@ class AnalyticsWindow:
         container.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
         # Extract analytics data
-        hourly_distribution = self.analytics.get('hourly_distribution', {})
+        hourly_counts = self.analytics.get('hourly_counts', np.zeros(24, dtype=np.int64))
+        hour_weekday = self.analytics.get('hour_weekday', np.zeros((7, 24), dtype=np.int64))
         
         # Create a figure for time distribution
         plt.style.use('ggplot')
@@ -518,7 +3165,7 @@ class AnalyticsWindow:
         # Hourly distribution as a line chart
         ax1 = fig.add_subplot(211)
         hours = list(range(24))
-        counts = [hourly_distribution.get(hour, 0) for hour in hours]
+        counts = hourly_counts
         
         # Add a line chart
         ax1.plot(hours, counts, marker='o', linestyle='-', color='#5cb85c', linewidth=2, markersize=8)
@@ -535,18 +3182,11 @@ class AnalyticsWindow:
                 ax1.text(i, count + 0.3, f'{count}', ha='center', va='bottom', fontsize=9)
         
         # Group by time of day (morning, afternoon, evening, night)
-        ax2 = fig.add_subplot(212)
-        
-        # Define time periods
-        time_periods = {
-            'Night (0-6)': sum(hourly_distribution.get(h, 0) for h in range(0, 6)),
-            'Morning (6-12)': sum(hourly_distribution.get(h, 0) for h in range(6, 12)),
-            'Afternoon (12-18)': sum(hourly_distribution.get(h, 0) for h in range(12, 18)),
-            'Evening (18-24)': sum(hourly_distribution.get(h, 0) for h in range(18, 24))
-        }
+        ax2 = fig.add_subplot(223)
         
-        periods = list(time_periods.keys())
-        values = list(time_periods.values())
+        # Define time periods as four 6-hour blocks
+        periods = ['Night (0-6)', 'Morning (6-12)', 'Afternoon (12-18)', 'Evening (18-24)']
+        values = np.asarray(hourly_counts).reshape(4, 6).sum(axis=1)
         
         # Create a pie chart
         wedges, texts, autotexts = ax2.pie(
@@ -568,6 +3208,16 @@ class AnalyticsWindow:
             autotext.set_fontsize(10)
             autotext.set_weight('bold')
             autotext.set_color('white')
+
+        # Day of week by hour of day
+        ax3 = fig.add_subplot(224)
+        ax3.imshow(hour_weekday, aspect='auto', cmap='viridis')
+        ax3.set_yticks(range(7))
+        ax3.set_yticklabels(['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'])
+        ax3.set_xticks(range(0, 24, 3))
+        ax3.set_xlabel('Hour of Day', fontsize=12)
+        ax3.set_title('Emails by Weekday and Hour', fontweight='bold', fontsize=14)
+        ax3.grid(False)
         
         plt.tight_layout(pad=3.0)
         
@@ -594,7 +3244,7 @@ class AnalyticsWindow:
         
         # Top 10 senders bar chart
         ax1 = fig.add_subplot(211)
-        top_senders = sorted(sender_frequency.items(), key=lambda x: x[1], reverse=True)[:10]
+        top_senders = self.analytics.get('top_senders', [])[:10]
         
         if top_senders:
             # Extract domain from email for grouping
@@ -791,6 +3441,86 @@ class AnalyticsWindow:
         canvas.get_tk_widget().pack(expand=True, fill="both", padx=20, pady=20)
 
 
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    # Handle a worker uses to report back to the GUI and to notice cancellation
+    def __init__(self, events=None):
+        self.events = events
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise JobCancelled("Cancelled")
+
+    def progress(self, message):
+        if self.events:
+            self.events.put((self, 'progress', message))
+
+    def partial(self, result):
+        if self.events:
+            self.events.put((self, 'partial', result))
+
+
+class JobRunner:
+    # Runs organizer calls off the Tk thread and hands their events back through window.after.
+    # A single worker: jobs share the organizer's IMAP session, which cannot interleave commands
+    def __init__(self, window, poll_interval=100):
+        self.window = window
+        self.poll_interval = poll_interval
+        self.events = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="EchoBoxJob")
+        self.handlers = {}
+
+    def submit(self, func, *args, on_done=None, on_progress=None, on_partial=None, on_cancelled=None):
+        # func is called as func(*args, job=job); handlers run on the Tk thread
+        job = Job(self.events)
+        self.handlers[job] = {'done': on_done, 'progress': on_progress,
+                              'partial': on_partial, 'cancelled': on_cancelled}
+        self.executor.submit(self.run, job, func, args)
+        if len(self.handlers) == 1:
+            self.window.after(self.poll_interval, self.poll)
+        return job
+
+    def run(self, job, func, args):
+        kind, result = 'cancelled', None
+        try:
+            if not job.cancelled.is_set():
+                result = func(*args, job=job)
+                kind = 'cancelled' if job.cancelled.is_set() else 'done'
+        except JobCancelled:
+            pass
+        except Exception as e:
+            kind, result = 'done', f"Error: {str(e)}"
+        self.events.put((job, kind, result))
+
+    def poll(self):
+        while True:
+            try:
+                job, kind, payload = self.events.get_nowait()
+            except queue.Empty:
+                break
+            handlers = self.handlers.get(job)
+            if handlers is None:
+                continue
+            if kind in ('done', 'cancelled'):
+                del self.handlers[job]
+            if handlers[kind]:
+                handlers[kind](payload)
+        if self.handlers:
+            self.window.after(self.poll_interval, self.poll)
+
+    def shutdown(self):
+        for job in list(self.handlers):
+            job.cancel()
+        self.executor.shutdown(wait=False)
+
+
 class EmailOrganizerGUI:
     def __init__(self):
         self.organizer = EmailOrganizer()
@@ -800,6 +3530,10 @@ class EmailOrganizerGUI:
         self.auto_reply_var = tk.BooleanVar(value=self.organizer.auto_reply_settings['enabled'])
         self.auto_reply_message = tk.Text()
         self.is_dark_mode = True  # Start with dark mode
+        self.inbox_watcher = None
+        self.watch_events = queue.Queue()
+        self.jobs = JobRunner(self.window)
+        self.index_refresh = None
         
         # Create icons first, before they're needed
         self.create_icons()
@@ -1025,6 +3759,15 @@ class EmailOrganizerGUI:
             width=20
         )
         process_button.pack(side=tk.LEFT, padx=10)
+
+        self.watch_button = ttkb.Button(
+            button_frame,
+            text="Watch Inbox",
+            command=self.toggle_watch,
+            bootstyle="info-outline",
+            width=20
+        )
+        self.watch_button.pack(side=tk.LEFT, padx=10)
         
         # Analytics content area with a card-like appearance
         analytics_container = ttk.Frame(dashboard_frame, style="Card.TFrame")
@@ -1072,6 +3815,15 @@ class EmailOrganizerGUI:
             width=15
         )
         add_rule_button.pack(side=tk.RIGHT)
+
+        train_button = ttkb.Button(
+            header_frame,
+            text="Train Classifier",
+            command=self.train_classifier,
+            bootstyle="info",
+            width=15
+        )
+        train_button.pack(side=tk.RIGHT, padx=10)
         
         # Rules list in a card-like container
         rules_container = ttk.Frame(rules_frame, style="Card.TFrame")
@@ -1095,7 +3847,7 @@ class EmailOrganizerGUI:
         
         self.rules_tree = ttk.Treeview(
             tree_frame, 
-            columns=('Name', 'Conditions', 'Folder'), 
+            columns=('Name', 'Conditions', 'Folder', 'Hits', 'Avg Time', 'Last Hit'), 
             show='headings',
             style="Treeview",
             yscrollcommand=tree_scroll.set
@@ -1105,13 +3857,19 @@ class EmailOrganizerGUI:
         tree_scroll.config(command=self.rules_tree.yview)
         
         # Configure column widths and headings
-        self.rules_tree.column('Name', width=200, anchor=tk.W)
-        self.rules_tree.column('Conditions', width=400, anchor=tk.W)
-        self.rules_tree.column('Folder', width=200, anchor=tk.W)
+        self.rules_tree.column('Name', width=160, anchor=tk.W)
+        self.rules_tree.column('Conditions', width=320, anchor=tk.W)
+        self.rules_tree.column('Folder', width=140, anchor=tk.W)
+        self.rules_tree.column('Hits', width=70, anchor=tk.E)
+        self.rules_tree.column('Avg Time', width=90, anchor=tk.E)
+        self.rules_tree.column('Last Hit', width=150, anchor=tk.W)
         
         self.rules_tree.heading('Name', text='Rule Name')
         self.rules_tree.heading('Conditions', text='Conditions')
         self.rules_tree.heading('Folder', text='Folder')
+        self.rules_tree.heading('Hits', text='Hits')
+        self.rules_tree.heading('Avg Time', text='Avg Time')
+        self.rules_tree.heading('Last Hit', text='Last Hit')
         
         self.rules_tree.pack(expand=True, fill=tk.BOTH)
         
@@ -1186,11 +3944,20 @@ class EmailOrganizerGUI:
         search_button = ttkb.Button(
             form_frame,
             text="Search",
-            command=lambda: self.search_emails(search_entry.get()),
+            command=lambda: self.search_emails(search_entry.get(), period_combo.get()),
             bootstyle="primary",
             width=15
         )
         search_button.grid(row=2, column=1, padx=5, pady=10, sticky=tk.E)
+
+        sync_button = ttkb.Button(
+            form_frame,
+            text="Sync Index",
+            command=self.sync_search_index,
+            bootstyle="secondary",
+            width=15
+        )
+        sync_button.grid(row=2, column=0, padx=5, pady=10, sticky=tk.W)
         
         # Results in a card-like container
         results_container = ttk.Frame(search_frame, style="Card.TFrame")
@@ -1214,7 +3981,7 @@ class EmailOrganizerGUI:
         
         self.search_results = ttk.Treeview(
             tree_frame, 
-            columns=('Subject', 'Sender', 'Date'), 
+            columns=('Subject', 'Sender', 'Folder', 'Date'), 
             show='headings',
             style="Treeview",
             yscrollcommand=tree_scroll.set
@@ -1226,10 +3993,12 @@ class EmailOrganizerGUI:
         # Configure column widths and headings
         self.search_results.column('Subject', width=400, anchor=tk.W)
         self.search_results.column('Sender', width=200, anchor=tk.W)
+        self.search_results.column('Folder', width=120, anchor=tk.W)
         self.search_results.column('Date', width=200, anchor=tk.W)
         
         self.search_results.heading('Subject', text='Subject')
         self.search_results.heading('Sender', text='Sender')
+        self.search_results.heading('Folder', text='Folder')
         self.search_results.heading('Date', text='Date')
         
         self.search_results.pack(expand=True, fill=tk.BOTH)
@@ -1269,20 +4038,68 @@ class EmailOrganizerGUI:
         # IMAP Server
         ttk.Label(form_frame, text="IMAP Server:", font=("Helvetica", 11)).grid(row=0, column=0, padx=10, pady=15, sticky=tk.W)
         self.imap_server_entry = ttkb.Entry(form_frame, width=40, bootstyle="primary")
-        self.imap_server_entry.insert(0, "imap.gmail.com")
+        self.imap_server_entry.insert(0, self.organizer.app_settings['imap_server'])
         self.imap_server_entry.grid(row=0, column=1, padx=10, pady=15, sticky=tk.W)
         
         # SMTP Server
         ttk.Label(form_frame, text="SMTP Server:", font=("Helvetica", 11)).grid(row=1, column=0, padx=10, pady=15, sticky=tk.W)
-        smtp_server_entry = ttkb.Entry(form_frame, width=40, bootstyle="primary")
-        smtp_server_entry.insert(0, "smtp.gmail.com")
-        smtp_server_entry.grid(row=1, column=1, padx=10, pady=15, sticky=tk.W)
+        self.smtp_server_entry = ttkb.Entry(form_frame, width=40, bootstyle="primary")
+        self.smtp_server_entry.insert(0, self.organizer.app_settings['smtp_server'])
+        self.smtp_server_entry.grid(row=1, column=1, padx=10, pady=15, sticky=tk.W)
         
         # Port
         ttk.Label(form_frame, text="SMTP Port:", font=("Helvetica", 11)).grid(row=2, column=0, padx=10, pady=15, sticky=tk.W)
-        port_entry = ttkb.Entry(form_frame, width=40, bootstyle="primary")
-        port_entry.insert(0, "587")
-        port_entry.grid(row=2, column=1, padx=10, pady=15, sticky=tk.W)
+        self.smtp_port_entry = ttkb.Entry(form_frame, width=40, bootstyle="primary")
+        self.smtp_port_entry.insert(0, str(self.organizer.app_settings['smtp_port']))
+        self.smtp_port_entry.grid(row=2, column=1, padx=10, pady=15, sticky=tk.W)
+
+        # Parallel sessions used for fetch-heavy analysis and search
+        ttk.Label(form_frame, text="IMAP Connections:", font=("Helvetica", 11)).grid(row=3, column=0, padx=10, pady=15, sticky=tk.W)
+        self.connection_pool_entry = ttkb.Entry(form_frame, width=40, bootstyle="primary")
+        self.connection_pool_entry.insert(0, str(self.organizer.app_settings['connection_pool_size']))
+        self.connection_pool_entry.grid(row=3, column=1, padx=10, pady=15, sticky=tk.W)
+
+        # Blocking imaplib/smtplib or the pipelined asyncio engine; applies on the next connect
+        ttk.Label(form_frame, text="Mail Engine:", font=("Helvetica", 11)).grid(row=4, column=0, padx=10, pady=15, sticky=tk.W)
+        self.mail_engine_combo = ttkb.Combobox(
+            form_frame,
+            values=["blocking", "asyncio"],
+            bootstyle="primary",
+            state="readonly",
+            width=38
+        )
+        self.mail_engine_combo.set(self.organizer.app_settings['mail_engine'])
+        self.mail_engine_combo.grid(row=4, column=1, padx=10, pady=15, sticky=tk.W)
+
+        # Let the server evaluate from/subject/body rules with IMAP SEARCH
+        ttk.Label(form_frame, text="Server-Side Rules:", font=("Helvetica", 11)).grid(row=5, column=0, padx=10, pady=15, sticky=tk.W)
+        self.server_side_rules_var = tk.BooleanVar(value=self.organizer.app_settings['server_side_rules'])
+        ttkb.Checkbutton(
+            form_frame,
+            variable=self.server_side_rules_var,
+            bootstyle="success-round-toggle",
+            text="Match rules with IMAP SEARCH instead of downloading mail"
+        ).grid(row=5, column=1, padx=10, pady=15, sticky=tk.W)
+
+        # Try frequently hit rules first where that cannot change which folder a message lands in
+        ttk.Label(form_frame, text="Adaptive Rule Order:", font=("Helvetica", 11)).grid(row=6, column=0, padx=10, pady=15, sticky=tk.W)
+        self.adaptive_rule_order_var = tk.BooleanVar(value=self.organizer.app_settings['adaptive_rule_order'])
+        ttkb.Checkbutton(
+            form_frame,
+            variable=self.adaptive_rule_order_var,
+            bootstyle="success-round-toggle",
+            text="Reorder non-conflicting rules by hit rate"
+        ).grid(row=6, column=1, padx=10, pady=15, sticky=tk.W)
+
+        # File mail no rule matched into OTP / Promotions / Updates / General
+        ttk.Label(form_frame, text="Classifier Fallback:", font=("Helvetica", 11)).grid(row=7, column=0, padx=10, pady=15, sticky=tk.W)
+        self.classifier_fallback_var = tk.BooleanVar(value=self.organizer.app_settings['classifier_fallback'])
+        ttkb.Checkbutton(
+            form_frame,
+            variable=self.classifier_fallback_var,
+            bootstyle="success-round-toggle",
+            text="Categorize unmatched mail with the trained classifier"
+        ).grid(row=7, column=1, padx=10, pady=15, sticky=tk.W)
         
         # Analysis settings section
         ttk.Label(
@@ -1298,7 +4115,7 @@ class EmailOrganizerGUI:
         # Default analysis period
         ttk.Label(analysis_frame, text="Default Analysis Period (days):", font=("Helvetica", 11)).grid(row=0, column=0, padx=10, pady=15, sticky=tk.W)
         self.analysis_period_entry = ttkb.Entry(analysis_frame, width=40, bootstyle="primary")
-        self.analysis_period_entry.insert(0, "30")
+        self.analysis_period_entry.insert(0, str(self.organizer.app_settings['analysis_period']))
         self.analysis_period_entry.grid(row=0, column=1, padx=10, pady=15, sticky=tk.W)
         
         # Chart type
@@ -1311,6 +4128,18 @@ class EmailOrganizerGUI:
         )
         chart_combo.current(0)
         chart_combo.grid(row=1, column=1, padx=10, pady=15, sticky=tk.W)
+
+        # Number of messages pulled per FETCH round trip
+        ttk.Label(analysis_frame, text="Fetch Batch Size (messages):", font=("Helvetica", 11)).grid(row=2, column=0, padx=10, pady=15, sticky=tk.W)
+        self.fetch_batch_size_entry = ttkb.Entry(analysis_frame, width=40, bootstyle="primary")
+        self.fetch_batch_size_entry.insert(0, str(self.organizer.fetch_batch_size))
+        self.fetch_batch_size_entry.grid(row=2, column=1, padx=10, pady=15, sticky=tk.W)
+
+        # Approximate top senders/keywords in fixed memory; larger is more accurate
+        ttk.Label(analysis_frame, text="Top-K Sketch Size (0 = exact):", font=("Helvetica", 11)).grid(row=3, column=0, padx=10, pady=15, sticky=tk.W)
+        self.sketch_capacity_entry = ttkb.Entry(analysis_frame, width=40, bootstyle="primary")
+        self.sketch_capacity_entry.insert(0, str(self.organizer.app_settings['analytics_sketch_capacity']))
+        self.sketch_capacity_entry.grid(row=3, column=1, padx=10, pady=15, sticky=tk.W)
         
         # Save button
         save_settings_button = ttkb.Button(
@@ -1360,6 +4189,18 @@ class EmailOrganizerGUI:
             text="Enabled" if self.auto_reply_var.get() else "Disabled"
         )
         auto_reply_switch.pack(side=tk.LEFT, padx=10)
+
+        # Replies are queued and sent in the background, no faster than this
+        ttk.Label(enable_frame, text="Replies per minute:", font=("Helvetica", 12)).pack(side=tk.LEFT, padx=(30, 5))
+        self.auto_reply_rate_entry = ttkb.Entry(enable_frame, width=8, bootstyle="primary")
+        self.auto_reply_rate_entry.insert(0, str(self.organizer.auto_reply_settings['rate_per_minute']))
+        self.auto_reply_rate_entry.pack(side=tk.LEFT, padx=5)
+
+        # Each sender gets at most one reply per window
+        ttk.Label(enable_frame, text="Once per sender every (hours):", font=("Helvetica", 12)).pack(side=tk.LEFT, padx=(30, 5))
+        self.auto_reply_window_entry = ttkb.Entry(enable_frame, width=8, bootstyle="primary")
+        self.auto_reply_window_entry.insert(0, str(self.organizer.auto_reply_settings['reply_window_hours']))
+        self.auto_reply_window_entry.pack(side=tk.LEFT, padx=5)
         
         # Auto-reply message
         message_frame = ttk.Frame(reply_container)
@@ -1512,6 +4353,54 @@ class EmailOrganizerGUI:
             self.status_var.set("Error: Failed to connect to email server")
             messagebox.showerror("Error", "Failed to connect to email server")
 
+    def start_job(self, title, message, func, *args, on_done=None, on_partial=None, bootstyle="success-striped"):
+        # Progress dialog for an organizer call running on the job worker; the window stays responsive
+        progress = ttkb.Toplevel(self.window)
+        progress.title(title)
+        progress.geometry("300x190")
+
+        label = ttk.Label(progress, text=message, font=("Helvetica", 12), wraplength=260)
+        label.pack(pady=(20, 10))
+
+        progress_bar = ttkb.Progressbar(
+            progress, 
+            bootstyle=bootstyle,
+            mode="indeterminate",
+            length=250
+        )
+        progress_bar.pack(pady=10, padx=20)
+        progress_bar.start()
+
+        def report(text):
+            label.config(text=text)
+            self.status_var.set(text)
+
+        def finished(result):
+            progress.destroy()
+            if on_done:
+                on_done(result)
+
+        def cancelled(result):
+            progress.destroy()
+            # Work finished before the cancel (e.g. messages already moved) is still reported
+            if isinstance(result, str) and not result.startswith("Error"):
+                self.status_var.set(f"Cancelled. {result}")
+            else:
+                self.status_var.set("Cancelled.")
+
+        job = self.jobs.submit(func, *args, on_done=finished, on_progress=report,
+                               on_partial=on_partial, on_cancelled=cancelled)
+
+        def cancel():
+            job.cancel()
+            label.config(text="Cancelling...")
+            cancel_button.config(state=tk.DISABLED)
+
+        cancel_button = ttkb.Button(progress, text="Cancel", command=cancel, bootstyle="secondary", width=10)
+        cancel_button.pack(pady=(0, 10))
+        progress.protocol("WM_DELETE_WINDOW", cancel)
+        return job
+
     def show_analytics(self):
         if not self.organizer.imap_server:
             messagebox.showerror("Error", "Please connect to your email first.")
@@ -1521,37 +4410,19 @@ class EmailOrganizerGUI:
                                          minvalue=1, maxvalue=365, initialvalue=30)
         if days:
             self.status_var.set("Analyzing emails...")
-            
-            # Show a progress dialog
-            progress = ttkb.Toplevel(self.window)
-            progress.title("Analyzing Emails")
-            progress.geometry("300x150")
-            
-            ttk.Label(progress, text="Analyzing your emails...", font=("Helvetica", 12)).pack(pady=(20, 10))
-            
-            progress_bar = ttkb.Progressbar(
-                progress, 
-                bootstyle="success-striped",
-                mode="indeterminate",
-                length=250
-            )
-            progress_bar.pack(pady=10, padx=20)
-            progress_bar.start()
-            
-            # Update the UI to show we're working
-            self.window.update()
-            
-            # Perform the analysis
-            analytics = self.organizer.analyze_emails(days)
-            
-            # Close the progress dialog
-            progress.destroy()
-            
-            self.status_var.set("Analysis complete.")
-            
-            # Open a new window to display analytics instead of showing in the dashboard
-            AnalyticsWindow(self.window, analytics, self.is_dark_mode)
+            self.start_job("Analyzing Emails", "Analyzing your emails...",
+                           self.organizer.analyze_emails, days, on_done=self.analytics_ready)
+
+    def analytics_ready(self, analytics):
+        if isinstance(analytics, str):
+            self.status_var.set(analytics)
+            messagebox.showerror("Error", analytics)
+            return
 
+        self.status_var.set("Analysis complete.")
+        
+        # Open a new window to display analytics instead of showing in the dashboard
+        AnalyticsWindow(self.window, analytics, self.is_dark_mode)
 
     def process_emails(self):
         if not self.organizer.imap_server:
@@ -1559,39 +4430,86 @@ class EmailOrganizerGUI:
             return
 
         self.status_var.set("Processing emails...")
-        
-        # Show a progress dialog
-        progress = ttkb.Toplevel(self.window)
-        progress.title("Processing Emails")
-        progress.geometry("300x150")
-        
-        ttk.Label(progress, text="Processing your emails...", font=("Helvetica", 12)).pack(pady=(20, 10))
-        
-        progress_bar = ttkb.Progressbar(
-            progress, 
-            bootstyle="success-striped",
-            mode="indeterminate",
-            length=250
-        )
-        progress_bar.pack(pady=10, padx=20)
-        progress_bar.start()
-        
-        # Update the UI to show we're working
-        self.window.update()
-        
-        # Process the emails
-        result = self.organizer.process_emails()
-        
-        # Close the progress dialog
-        progress.destroy()
-        
+        self.start_job("Processing Emails", "Processing your emails...",
+                       self.organizer.process_emails, on_done=self.processing_done)
+
+    def train_classifier(self):
+        if not self.organizer.imap_server:
+            messagebox.showerror("Error", "Please connect to your email first.")
+            return
+
+        self.status_var.set("Training classifier...")
+        self.start_job("Training Classifier", "Learning from your category folders...",
+                       self.organizer.train_classifier, on_done=self.classifier_trained, bootstyle="info-striped")
+
+    def classifier_trained(self, result):
+        self.status_var.set(result)
+        if result.startswith("Error"):
+            messagebox.showerror("Error", result)
+        else:
+            messagebox.showinfo("Classifier", result)
+
+    def processing_done(self, result):
         self.status_var.set(result)
+        self.update_rules_list()
+        self.refresh_search_index()
         messagebox.showinfo("Processing Result", result)
 
+    def refresh_search_index(self):
+        # Quietly brings a synced index up to date on the job worker; at most one refresh is queued
+        if self.index_refresh or not self.organizer.search_index.is_synced(self.organizer.email_address):
+            return
+
+        def refreshed(result):
+            self.index_refresh = None
+            if isinstance(result, str) and result.startswith("Error"):
+                self.status_var.set(result)
+
+        self.index_refresh = self.jobs.submit(self.organizer.refresh_search_index,
+                                              on_done=refreshed, on_cancelled=refreshed)
+
+    def toggle_watch(self):
+        if self.inbox_watcher:
+            self.inbox_watcher.stop()
+            self.inbox_watcher = None
+            self.watch_button.config(text="Watch Inbox", bootstyle="info-outline")
+            return
+
+        if not self.organizer.imap_server:
+            messagebox.showerror("Error", "Please connect to your email first.")
+            return
+
+        # The watcher thread only queues messages; Tk widgets are updated from the main loop
+        self.inbox_watcher = InboxWatcher(self.organizer, on_result=self.watch_events.put)
+        self.inbox_watcher.start()
+        self.watch_button.config(text="Stop Watching", bootstyle="info")
+        self.poll_watch_events(self.inbox_watcher)
+
+    def poll_watch_events(self, watcher):
+        received = False
+        processed = False
+        while True:
+            try:
+                event = self.watch_events.get_nowait()
+            except queue.Empty:
+                break
+            self.status_var.set(event)
+            received = True
+            processed = processed or event.startswith("Processed")
+        if received:
+            # The watcher's processing runs update the rule statistics
+            self.update_rules_list()
+        if processed:
+            # ...and bring new mail (and what the rules moved) into the search index
+            self.refresh_search_index()
+        # Keep draining until the watcher thread has reported that it stopped
+        if watcher.thread.is_alive() or not self.watch_events.empty():
+            self.window.after(500, self.poll_watch_events, watcher)
+
     def show_add_rule_dialog(self):
         dialog = ttkb.Toplevel(self.window)
         dialog.title("Add Email Rule")
-        dialog.geometry("500x550")
+        dialog.geometry("500x640")
         
         # Add a header
         header_frame = ttk.Frame(dialog)
@@ -1618,7 +4536,7 @@ class EmailOrganizerGUI:
         condition_type_frame = ttk.Frame(form_container)
         condition_type_frame.pack(fill=tk.X, padx=20, pady=(0, 15))
         
-        condition_types = [("From", "from"), ("Subject", "subject"), ("Body", "body")]
+        condition_types = [("From", "from"), ("Subject", "subject"), ("Body", "body"), ("Sender Domain", "domain")]
         for i, (text, value) in enumerate(condition_types):
             radio = ttkb.Radiobutton(
                 condition_type_frame,
@@ -1630,6 +4548,14 @@ class EmailOrganizerGUI:
             radio.pack(side=tk.LEFT, padx=10)
             if i == 0:
                 radio.invoke()  # Select the first option by default
+
+        use_regex = tk.BooleanVar(value=False)
+        ttkb.Checkbutton(
+            form_container,
+            text="Match as a regular expression (From, Subject, Body)",
+            variable=use_regex,
+            bootstyle="primary-round-toggle"
+        ).pack(anchor=tk.W, padx=20, pady=(0, 15))
         
         # Condition value
         ttk.Label(form_container, text="Condition Value:", font=("Helvetica", 11, "bold")).pack(anchor=tk.W, padx=20, pady=(0, 5))
@@ -1639,7 +4565,7 @@ class EmailOrganizerGUI:
         # Help text for condition
         help_text = ttk.Label(
             form_container, 
-            text="Example: For 'From' condition, enter an email address or domain.\nFor 'Subject' or 'Body', enter keywords to match.",
+            text="Example: For 'From' condition, enter an email address or domain.\nFor 'Subject' or 'Body', enter keywords to match.\nFor 'Sender Domain', list exact domains separated by commas.",
             justify=tk.LEFT,
             font=("Helvetica", 9),
             foreground="#888888"
@@ -1679,7 +4605,7 @@ class EmailOrganizerGUI:
             text="Add Rule",
             command=lambda: self.add_rule(
                 rule_name_entry.get(),
-                condition_type.get(),
+                f"{condition_type.get()}_regex" if use_regex.get() and condition_type.get() != 'domain' else condition_type.get(),
                 condition_value_entry.get(),
                 target_folder_entry.get(),
                 dialog
@@ -1697,8 +4623,10 @@ class EmailOrganizerGUI:
                 "condition_value": condition_value,
                 "folder": target_folder
             }
-            self.organizer.rules.append(rule)
-            self.organizer.save_rules()
+            error = self.organizer.add_rule(rule)
+            if error:
+                messagebox.showerror("Error", error)
+                return
             self.update_rules_list()
             messagebox.showinfo("Success", "Rule added successfully!")
             dialog.destroy()
@@ -1706,17 +4634,32 @@ class EmailOrganizerGUI:
             messagebox.showerror("Error", "All fields must be filled!")
 
     def update_rules_list(self):
+        self.organizer.reload_rules()
         for row in self.rules_tree.get_children():
             self.rules_tree.delete(row)
         for rule in self.organizer.rules:
-            self.rules_tree.insert('', 'end', values=(rule['name'], f"{rule['condition_type']}: {rule['condition_value']}", rule['folder']))
+            stats = self.organizer.rule_stats.get(rule)
+            average = f"{stats['seconds'] / stats['evaluations'] * 1e6:.0f} µs" if stats['evaluations'] else ''
+            self.rules_tree.insert('', 'end', values=(rule['name'], describe_condition(rule), rule['folder'],
+                                                      stats['hits'], average, (stats['last_hit'] or '').replace('T', ' ')))
 
-    def search_emails(self, query):
+    def sync_search_index(self):
         if not self.organizer.imap_server:
             messagebox.showerror("Error", "Please connect to your email first.")
             return
 
-         
+        self.status_var.set("Indexing emails...")
+        self.start_job("Indexing Emails", "Indexing your emails...",
+                       self.organizer.sync_search_index, on_done=self.index_synced, bootstyle="info-striped")
+
+    def index_synced(self, result):
+        self.status_var.set(result)
+        if result.startswith("Error"):
+            messagebox.showerror("Error", result)
+
+    def search_emails(self, query, period="Last 30 days"):
+        # A synced local index answers searches even while disconnected
+        if not self.organizer.imap_server and not self.organizer.search_index.is_synced(self.organizer.email_address):
             messagebox.showerror("Error", "Please connect to your email first.")
             return
 
@@ -1725,41 +4668,31 @@ class EmailOrganizerGUI:
             return
 
         self.status_var.set("Searching emails...")
-        
-        # Show a progress dialog
-        progress = ttkb.Toplevel(self.window)
-        progress.title("Searching Emails")
-        progress.geometry("300x150")
-        
-        ttk.Label(progress, text="Searching your emails...", font=("Helvetica", 12)).pack(pady=(20, 10))
-        
-        progress_bar = ttkb.Progressbar(
-            progress, 
-            bootstyle="info-striped",
-            mode="indeterminate",
-            length=250
-        )
-        progress_bar.pack(pady=10, padx=20)
-        progress_bar.start()
-        
-        # Update the UI to show we're working
-        self.window.update()
-        
-        # Perform the search
-        results = self.organizer.search_emails(query)
-        
-        # Close the progress dialog
-        progress.destroy()
-        
-        self.status_var.set("Search complete.")
+        self.clear_search_results()
+
+        days = {"Last 7 days": 7, "Last 30 days": 30, "Last 90 days": 90, "All time": None}.get(period, 30)
+        self.start_job("Searching Emails", "Searching your emails...",
+                       self.organizer.search_emails, query, days,
+                       on_done=self.search_done, on_partial=self.show_search_records, bootstyle="info-striped")
 
+    def clear_search_results(self):
         for row in self.search_results.get_children():
             self.search_results.delete(row)
 
+    def show_search_records(self, records):
+        # Rows appear as header batches arrive; search_done replaces them with the final ordered list
+        for record in records:
+            result = search_result(record)
+            self.search_results.insert('', 'end', values=(result['subject'], result['sender'], result['folder'], result['date']))
+
+    def search_done(self, results):
+        self.status_var.set("Search complete.")
+        self.clear_search_results()
+
         if isinstance(results, list):
             if results:
                 for result in results:
-                    self.search_results.insert('', 'end', values=(result['subject'], result['sender'], result['date']))
+                    self.search_results.insert('', 'end', values=(result['subject'], result['sender'], result['folder'], result['date']))
             else:
                 messagebox.showinfo("Search Results", "No emails found matching your search criteria.")
         else:
@@ -1783,6 +4716,37 @@ class EmailOrganizerGUI:
     def save_settings(self):
         imap_server = self.imap_server_entry.get()
         analysis_period = self.analysis_period_entry.get()
+        fetch_batch_size = self.fetch_batch_size_entry.get()
+        connection_pool_size = self.connection_pool_entry.get()
+        smtp_server = self.smtp_server_entry.get().strip()
+        smtp_port = self.smtp_port_entry.get().strip()
+        sketch_capacity = self.sketch_capacity_entry.get().strip()
+
+        if not all(value.isdigit() and int(value) > 0 for value in (analysis_period, fetch_batch_size, connection_pool_size)):
+            messagebox.showerror("Error", "Analysis period, fetch batch size and IMAP connections must be positive numbers!")
+            return
+        if not smtp_server or not smtp_port.isdigit() or not 0 < int(smtp_port) < 65536:
+            messagebox.showerror("Error", "Enter an SMTP server and a port between 1 and 65535!")
+            return
+        if not sketch_capacity.isdigit() or 0 < int(sketch_capacity) < 10:
+            messagebox.showerror("Error", "Top-K sketch size must be 0 (exact) or at least 10!")
+            return
+
+        settings = dict(self.organizer.app_settings)
+        settings.update({
+            "imap_server": imap_server,
+            "smtp_server": smtp_server,
+            "smtp_port": int(smtp_port),
+            "analysis_period": int(analysis_period),
+            "fetch_batch_size": int(fetch_batch_size),
+            "connection_pool_size": int(connection_pool_size),
+            "analytics_sketch_capacity": int(sketch_capacity),
+            "mail_engine": self.mail_engine_combo.get(),
+            "server_side_rules": self.server_side_rules_var.get(),
+            "adaptive_rule_order": self.adaptive_rule_order_var.get(),
+            "classifier_fallback": self.classifier_fallback_var.get()
+        })
+        self.organizer.save_app_settings(settings)
         
         # Add visual feedback
         self.status_var.set("Settings saved successfully!")
@@ -1799,9 +4763,16 @@ class EmailOrganizerGUI:
         success.after(2000, success.destroy)
 
     def save_auto_reply(self):
+        rate = self.auto_reply_rate_entry.get().strip()
+        window = self.auto_reply_window_entry.get().strip()
+        if not rate.isdigit() or int(rate) <= 0 or not window.isdigit():
+            messagebox.showerror("Error", "Replies per minute must be a positive number and the reply window a whole number of hours!")
+            return
         settings = {
             "enabled": self.auto_reply_var.get(),
-            "message": self.auto_reply_message.get("1.0", tk.END).strip()
+            "message": self.auto_reply_message.get("1.0", tk.END).strip(),
+            "rate_per_minute": int(rate),
+            "reply_window_hours": int(window)
         }
         self.organizer.save_auto_reply_settings(settings)
         
@@ -1919,9 +4890,44 @@ class EmailOrganizerGUI:
         style.configure("Danger.TFrame", background="#d9534f")
         style.configure("Primary.TFrame", background="#0275d8")
         
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
         self.window.mainloop()
 
+    def close(self):
+        # Running jobs stop at their next batch boundary instead of keeping the process alive
+        self.jobs.shutdown()
+        if self.inbox_watcher:
+            self.inbox_watcher.stop()
+        self.organizer.reply_sender.stop()
+        self.organizer.close_smtp()
+        self.window.destroy()
+
+
+def print_simulation(summary):
+    if isinstance(summary, str):
+        print(summary)
+        return
+    print(f"{summary['messages']} emails in {summary['seconds']:.2f}s, "
+          f"rule engine {summary['engine_seconds']:.3f}s ({summary['messages_per_second']:.0f} msgs/s), "
+          f"{summary['template_hits']} template cache hits")
+    for folder, count in sorted(summary['folders'].items(), key=lambda item: -item[1]):
+        print(f"  {folder:<30} {count:>8}")
+    if summary['rules']:
+        print(f"  {'Rule':<40} {'Folder':<16} {'Hits':>7} {'Evals':>8} {'Avg us':>8} {'Total ms':>9}")
+        for rule in summary['rules']:
+            print(f"  {rule['rule'][:40]:<40} {rule['folder'][:16]:<16} {rule['hits']:>7} "
+                  f"{rule['evaluations']:>8} {rule['avg_us']:>8.1f} {rule['total_ms']:>9.2f}")
+
 
 if __name__ == "__main__":
-    app = EmailOrganizerGUI()
-    app.run()
+    import argparse
+    parser = argparse.ArgumentParser(description="Email Organizer")
+    parser.add_argument('--simulate', metavar='PATH', help="dry-run the rules over a local mbox file or Maildir")
+    parser.add_argument('--limit', type=int, help="stop after this many emails")
+    parser.add_argument('--output', metavar='CSV', help="write the folder chosen for each email")
+    args = parser.parse_args()
+    if args.simulate:
+        print_simulation(EmailOrganizer().simulate(args.simulate, args.limit, args.output))
+    else:
+        app = EmailOrganizerGUI()
+        app.run()
@@ -0,0 +1,38 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Test22
+
+
+def records(day, count):
+    return [{'uid': day * 1000 + i, 'date': 1.7e9 + day * 86400 + i * 60, 'sender': f's{i % 5}@example.com',
+             'subject': 'Weekly invoice reminder', 'in_reply_to': False, 'size': 1000 + 37 * i * i,
+             'attachments': []} for i in range(count)]
+
+
+class DayRollupTest(unittest.TestCase):
+    def test_binned_sizes_merge_like_per_message_sizes(self):
+        days = [('2026-10-%02d' % (day + 1), records(day, 200)) for day in range(3)]
+        hours = np.zeros(200, dtype=np.int64)
+        exact = [(day, Test22.day_rollup(day_records, hours)) for day, day_records in days]
+        binned = [(day, Test22.day_rollup(day_records, hours, binned=True)) for day, day_records in days]
+        self.assertNotIn('sizes', binned[0][1])
+        self.assertLess(len(binned[0][1]['size_bins'][0]), 200)
+
+        from_sizes = Test22.merge_rollups(iter(exact), sketch_capacity=50)
+        from_bins = Test22.merge_rollups(iter(binned), sketch_capacity=50)
+        self.assertEqual(from_bins['total_emails'], 600)
+        self.assertEqual(from_bins['size_percentiles'], from_sizes['size_percentiles'])
+        np.testing.assert_array_equal(from_bins['size_histogram'][0], from_sizes['size_histogram'][0])
+
+    def test_signature_tells_binned_from_exact(self):
+        self.assertNotEqual(Test22.rollup_signature(7, [1, 2, 3]), Test22.rollup_signature(7, [1, 2, 3], binned=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
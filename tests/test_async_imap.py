@@ -0,0 +1,103 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Test22
+
+
+class FakeIMAPServer:
+    # Just enough IMAP for SELECT, NOOP and IDLE; new_mail() makes the next NOOP report an EXISTS
+    def __init__(self):
+        self.exists = 3
+        self.pending_exists = False
+        self.commands = []
+
+    def new_mail(self):
+        self.exists += 1
+        self.pending_exists = True
+
+    async def handle(self, reader, writer):
+        def reply(line):
+            writer.write(line.encode('ascii') + b'\r\n')
+
+        reply("* OK fake IMAP ready")
+        await writer.drain()
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            tag, command = line.decode('ascii').strip().split(' ', 1)
+            verb = command.split(' ', 1)[0].upper()
+            self.commands.append(verb)
+            if verb == 'CAPABILITY':
+                reply("* CAPABILITY IMAP4rev1 IDLE")
+                reply(f"{tag} OK done")
+            elif verb == 'SELECT':
+                reply(f"* {self.exists} EXISTS")
+                reply("* OK [UIDNEXT 10] next")
+                reply(f"{tag} OK [READ-WRITE] selected")
+            elif verb == 'NOOP':
+                if self.pending_exists:
+                    self.pending_exists = False
+                    reply(f"* {self.exists} EXISTS")
+                reply(f"{tag} OK done")
+            elif verb == 'IDLE':
+                reply("+ idling")
+                await writer.drain()
+                while (await reader.readline()).strip() != b'DONE':
+                    pass
+                reply(f"{tag} OK idle done")
+            elif verb == 'LOGOUT':
+                reply("* BYE")
+                reply(f"{tag} OK bye")
+                await writer.drain()
+                break
+            else:
+                reply(f"{tag} BAD unknown")
+            await writer.drain()
+        writer.close()
+
+
+class AsyncIMAPClientIdleTest(unittest.TestCase):
+    def run_scenario(self, scenario):
+        async def main():
+            server = FakeIMAPServer()
+            listener = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+            client = Test22.AsyncIMAPClient('127.0.0.1', listener.sockets[0].getsockname()[1], use_ssl=False)
+            await client.connect()
+            await client.select('INBOX')
+            try:
+                return await scenario(server, client)
+            finally:
+                await client.simple_command('LOGOUT')
+                listener.close()
+                await listener.wait_closed()
+
+        return asyncio.run(main())
+
+    def test_exists_during_other_command_ends_next_idle(self):
+        async def scenario(server, client):
+            server.new_mail()
+            await client.noop()
+            typ, _ = await asyncio.wait_for(client.idle(timeout=30), 5)
+            return typ, server.commands
+
+        typ, commands = self.run_scenario(scenario)
+        self.assertEqual(typ, 'OK')
+        self.assertNotIn('IDLE', commands)
+
+    def test_select_count_is_not_new_mail(self):
+        async def scenario(server, client):
+            typ, exists = await client.idle(timeout=0.2)
+            return typ, exists, server.commands
+
+        typ, exists, commands = self.run_scenario(scenario)
+        self.assertEqual((typ, exists), ('OK', []))
+        self.assertIn('IDLE', commands)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import smtplib
+import sys
+import unittest
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Test22
+
+
+class FakeSMTPServer:
+    # Accepts everything except RCPT to refused@..., and answers DATA with 554 when no recipient
+    # of the current transaction was accepted
+    def __init__(self, pipelining=True):
+        self.pipelining = pipelining
+        self.delivered = []
+
+    async def handle(self, reader, writer):
+        def reply(line):
+            writer.write(line.encode('ascii') + b'\r\n')
+
+        reply("220 fake ESMTP")
+        recipients = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line.decode('utf-8').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                reply("250-fake" + ("\r\n250-PIPELINING" if self.pipelining else "") + "\r\n250 8BITMIME")
+            elif verb == 'MAIL':
+                recipients = []
+                reply("250 ok")
+            elif verb == 'RCPT':
+                if 'refused@' in command:
+                    reply("550 no such user")
+                else:
+                    recipients.append(command.split('<', 1)[1].rstrip('>'))
+                    reply("250 ok")
+            elif verb == 'DATA':
+                if not recipients:
+                    reply("554 no valid recipients")
+                    continue
+                reply("354 go ahead")
+                while (await reader.readline()) != b'.\r\n':
+                    pass
+                self.delivered.extend(recipients)
+                recipients = []
+                reply("250 queued")
+            elif verb == 'RSET':
+                recipients = []
+                reply("250 reset")
+            elif verb == 'QUIT':
+                reply("221 bye")
+                await writer.drain()
+                break
+            else:
+                reply("502 unknown")
+            await writer.drain()
+        writer.close()
+
+
+def reply_to(recipient):
+    msg = MIMEText("Thanks")
+    msg['From'] = 'me@example.com'
+    msg['To'] = recipient
+    return msg
+
+
+class AsyncSMTPClientTest(unittest.TestCase):
+    def run_session(self, pipelining):
+        async def scenario():
+            server = FakeSMTPServer(pipelining)
+            listener = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+            port = listener.sockets[0].getsockname()[1]
+            client = Test22.AsyncSMTPClient('127.0.0.1', port)
+            await client.connect()
+            results = []
+            for recipient in ('first@example.com', 'refused@example.com', 'second@example.com', 'third@example.com'):
+                try:
+                    await client.send_message(reply_to(recipient))
+                    results.append('sent')
+                except smtplib.SMTPRecipientsRefused:
+                    results.append('refused')
+            await client.quit()
+            listener.close()
+            await listener.wait_closed()
+            return results, server.delivered
+
+        return asyncio.run(scenario())
+
+    def test_refused_recipient_leaves_pipelined_session_usable(self):
+        results, delivered = self.run_session(pipelining=True)
+        self.assertEqual(results, ['sent', 'refused', 'sent', 'sent'])
+        self.assertEqual(delivered, ['first@example.com', 'second@example.com', 'third@example.com'])
+
+    def test_refused_recipient_without_pipelining(self):
+        results, delivered = self.run_session(pipelining=False)
+        self.assertEqual(results, ['sent', 'refused', 'sent', 'sent'])
+        self.assertEqual(delivered, ['first@example.com', 'second@example.com', 'third@example.com'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Test22
+
+
+class CountingSpool(Test22.OutboundSpool):
+    def __init__(self, path):
+        super().__init__(path)
+        self.polls = 0
+
+    def next_due(self, account):
+        self.polls += 1
+        return super().next_due(account)
+
+
+class FakeSession:
+    def __init__(self):
+        self.smtp = object()
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg['To'])
+
+
+class FakeOrganizer:
+    def __init__(self, path):
+        self.email_address = 'me@example.com'
+        self.password = 'secret'
+        self.auto_reply_settings = {'rate_per_minute': 6000}
+        self.outbound_spool = CountingSpool(path)
+        self.session = FakeSession()
+
+    def smtp(self):
+        return self.session
+
+
+class AutoReplySenderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.organizer = FakeOrganizer(os.path.join(self.directory.name, 'email_cache.db'))
+        self.sender = Test22.AutoReplySender(self.organizer)
+
+    def tearDown(self):
+        self.sender.stop()
+        self.sender.thread.join(5)
+        self.organizer.outbound_spool.db.close()
+        self.directory.cleanup()
+
+    def reply(self, recipient):
+        msg = MIMEText("Thanks")
+        msg['From'] = self.organizer.email_address
+        msg['To'] = recipient
+        return msg
+
+    def test_idle_sender_waits_for_wake(self):
+        self.sender.start()
+        time.sleep(0.5)
+        # One look at the empty spool, then it sleeps until woken
+        self.assertLessEqual(self.organizer.outbound_spool.polls, 3)
+
+    def test_wake_sends_queued_reply(self):
+        self.sender.start()
+        time.sleep(0.2)
+        self.organizer.outbound_spool.enqueue(self.organizer.email_address, [self.reply('friend@example.com')])
+        self.sender.wake()
+        deadline = time.monotonic() + 5
+        while not self.organizer.session.sent and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.organizer.session.sent, ['friend@example.com'])
+        self.assertEqual(self.organizer.outbound_spool.counts(self.organizer.email_address), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
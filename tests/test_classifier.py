@@ -0,0 +1,115 @@
+import os
+import sys
+import tempfile
+import unittest
+from email.mime.text import MIMEText
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Test22
+
+
+def message(sender, subject, body):
+    msg = MIMEText(body)
+    msg['From'] = sender
+    msg['Subject'] = subject
+    return msg
+
+
+TRAINING = [
+    ('OTP', message('noreply@bank.example', 'Your code is 482913', 'Use this code to sign in')),
+    ('OTP', message('security@mail.example', 'Verification code 110374', 'Your one time code expires soon')),
+    ('Promotions', message('deals@shop.example', 'Big sale this weekend', 'Save 50% on everything, shop now')),
+    ('Promotions', message('offers@store.example', 'Exclusive offer inside', 'Limited time sale, discount code')),
+    ('Updates', message('github@notifications.example', 'Build passed', 'Your pipeline finished successfully')),
+]
+
+
+class NaiveBayesClassifierTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'classifier.npz')
+        self.classifier = Test22.NaiveBayesClassifier(self.path, dimensions=2 ** 12)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def train(self):
+        return self.classifier.fit([(category, self.classifier.features(msg)) for category, msg in TRAINING])
+
+    def test_features_fold_digits_into_one_bucket(self):
+        first = self.classifier.features(message('a@bank.example', 'Code 482913', ''))
+        second = self.classifier.features(message('b@bank.example', 'Code 110374', ''))
+        np.testing.assert_array_equal(first[0], second[0])
+        self.assertTrue((first[0] < self.classifier.dimensions).all())
+        # Repeated words are counted, not listed twice
+        indices, counts = self.classifier.features(message('a@x.example', 'sale sale sale', ''))
+        self.assertEqual(len(indices), len(set(indices.tolist())))
+        self.assertEqual(counts.max(), 3)
+
+    def test_untrained_predicts_nothing(self):
+        self.assertFalse(self.classifier.trained)
+        self.assertEqual(self.classifier.predict([self.classifier.features(TRAINING[0][1])]), [])
+
+    def test_train_and_predict(self):
+        self.assertTrue(self.train())
+        rows = [self.classifier.features(message('alerts@bank2.example', 'Your code is 995511', 'sign in code')),
+                self.classifier.features(message('promo@shop2.example', 'Weekend sale', 'discount on everything'))]
+        predictions = self.classifier.predict(rows)
+        self.assertEqual([category for category, _ in predictions], ['OTP', 'Promotions'])
+        self.assertTrue(all(0.5 < confidence <= 1.0 for _, confidence in predictions))
+
+    def test_posteriors_match_dense_computation(self):
+        self.train()
+        indices, counts = self.classifier.features(message('x@y.example', 'Build code sale', 'finished'))
+        dense = np.zeros(self.classifier.dimensions)
+        dense[indices] = counts
+        totals = self.classifier.feature_counts.sum(axis=1)
+        scores = []
+        for row in range(len(self.classifier.categories)):
+            if not self.classifier.document_counts[row]:
+                scores.append(-np.inf)
+                continue
+            likelihoods = np.log((self.classifier.feature_counts[row] + 1.0) / (totals[row] + self.classifier.dimensions))
+            prior = np.log(self.classifier.document_counts[row] / self.classifier.document_counts.sum())
+            scores.append(prior + dense @ likelihoods)
+        scores = np.array(scores)
+        posteriors = np.exp(scores - scores.max())
+        posteriors /= posteriors.sum()
+        category, confidence = self.classifier.predict([(indices, counts)])[0]
+        self.assertEqual(category, self.classifier.categories[int(posteriors.argmax())])
+        self.assertAlmostEqual(confidence, float(posteriors.max()), places=5)
+
+    def test_save_and_load(self):
+        self.train()
+        self.classifier.save()
+        loaded = Test22.NaiveBayesClassifier(self.path)
+        row = self.classifier.features(TRAINING[2][1])
+        self.assertEqual(loaded.dimensions, self.classifier.dimensions)
+        self.assertEqual(loaded.predict([row]), self.classifier.predict([row]))
+
+
+class ConfidenceThresholdTest(unittest.TestCase):
+    def decide(self, classifier, threshold, msg):
+        rule_set = Test22.CompiledRuleSet([])
+        organizer = SimpleNamespace(
+            rule_set=lambda: rule_set, classifier=classifier, template_cache=Test22.TemplateCache(10),
+            app_settings={'classifier_fallback': True, 'classifier_threshold': threshold})
+        run = Test22.RuleRun(organizer)
+        return run.decide(1, msg) + run.flush()
+
+    def test_low_confidence_leaves_message_in_place(self):
+        with tempfile.TemporaryDirectory() as directory:
+            classifier = Test22.NaiveBayesClassifier(os.path.join(directory, 'classifier.npz'), dimensions=2 ** 12)
+        classifier.fit([(category, classifier.features(msg)) for category, msg in TRAINING])
+        msg = message('deals@shop.example', 'Big sale', 'Save on everything')
+        confidence = classifier.predict([classifier.features(msg)])[0][1]
+        self.assertEqual(self.decide(classifier, confidence - 0.01, msg), [(1, 'Promotions', None)])
+        self.assertEqual(self.decide(classifier, min(confidence + 0.01, 1.01), msg), [(1, None, None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
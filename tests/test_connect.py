@@ -0,0 +1,39 @@
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Test22
+
+
+class FakeIMAP4:
+    # Like Gmail: MOVE and UIDPLUS are only advertised after LOGIN
+    def __init__(self, host):
+        self.capabilities = ('IMAP4REV1', 'AUTH=PLAIN')
+        self.logged_in = False
+
+    def login(self, user, password):
+        self.logged_in = True
+        return 'OK', [b'Logged in']
+
+    def capability(self):
+        extra = b' MOVE UIDPLUS' if self.logged_in else b''
+        return 'OK', [b'IMAP4rev1 IDLE' + extra]
+
+
+class ConnectTest(unittest.TestCase):
+    def test_capabilities_refreshed_after_login(self):
+        organizer = SimpleNamespace(
+            app_settings={'mail_engine': 'blocking', 'connection_pool_size': 1}, connection_pool=None,
+            close_smtp=lambda: None, reply_sender=SimpleNamespace(start=lambda: None))
+        with mock.patch.object(Test22.imaplib, 'IMAP4_SSL', FakeIMAP4):
+            self.assertTrue(Test22.EmailOrganizer.connect(organizer, 'me@example.com', 'secret'))
+        self.assertIn('MOVE', organizer.imap_server.capabilities)
+        self.assertIn('UIDPLUS', organizer.imap_server.capabilities)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import email
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Test22
+
+
+TEXT_PART = b'("TEXT" "PLAIN" ("CHARSET" "UTF-8") NIL NIL "7BIT" 12 1 NIL NIL NIL)'
+
+# A text part, a PDF attachment, an inline image with a file name, and a part that only names
+# itself in Content-Type (no Content-Disposition, so it is not counted)
+MIXED = (b'(' + TEXT_PART +
+         b'("APPLICATION" "PDF" ("NAME" "Invoice.PDF") NIL NIL "BASE64" 1000 NIL ("ATTACHMENT" ("FILENAME" "Invoice.PDF")) NIL)'
+         b'("IMAGE" "PNG" NIL "<logo>" NIL "BASE64" 200 NIL ("INLINE" ("FILENAME" "logo.png")) NIL)'
+         b'("APPLICATION" "ZIP" ("NAME" "bundle.zip") NIL NIL "BASE64" 300 NIL NIL NIL)'
+         b' "MIXED" ("BOUNDARY" "b1") NIL NIL)')
+
+# A forwarded message (message/rfc822) whose own attachment is a .docx
+NESTED = (b'(' + TEXT_PART +
+          b'("MESSAGE" "RFC822" NIL NIL NIL "7BIT" 900 '
+          b'("Mon, 1 Jan 2024 10:00:00 +0000" "Fwd" (("A" NIL "a" "example.com")) NIL NIL NIL NIL NIL NIL NIL) '
+          b'(' + TEXT_PART +
+          b'("APPLICATION" "VND.OPENXMLFORMATS-OFFICEDOCUMENT.WORDPROCESSINGML.DOCUMENT" NIL NIL NIL "BASE64" 500 NIL '
+          b'("ATTACHMENT" ("FILENAME" "Notes.DOCX")) NIL) "MIXED" ("BOUNDARY" "b3") NIL NIL) '
+          b'20 NIL ("ATTACHMENT" NIL) NIL)'
+          b' "MIXED" ("BOUNDARY" "b2") NIL NIL)')
+
+# RFC 2231 encoded file name, and a file name sent as a literal (falls back to the NAME parameter)
+ENCODED = (b'(' + TEXT_PART +
+           b'("APPLICATION" "PDF" NIL NIL NIL "BASE64" 1000 NIL '
+           b'("ATTACHMENT" ("FILENAME*" "utf-8\'\'R%C3%A9sum%C3%A9.PDF")) NIL)'
+           b'("APPLICATION" "VND.MS-EXCEL" ("NAME" "report.xls") NIL NIL "BASE64" 1000 NIL '
+           b'("ATTACHMENT" ("FILENAME" {10}\r\nreport.xls)) NIL)'
+           b' "MIXED" ("BOUNDARY" "b4") NIL NIL)')
+
+
+def attachment_types(bodystructure):
+    return Test22.bodystructure_attachment_types(Test22.parse_imap_list(bodystructure)[0])
+
+
+# What analytics counted before BODYSTRUCTURE: walk the downloaded message
+def downloaded_attachment_types(raw):
+    extensions = []
+    for part in email.message_from_bytes(raw).walk():
+        if part.get_content_maintype() == 'multipart' or part.get('Content-Disposition') is None:
+            continue
+        if part.get_filename():
+            extensions.append(os.path.splitext(part.get_filename())[1].lower())
+    return extensions
+
+
+MIXED_MESSAGE = b"""From: a@example.com
+Subject: Invoice
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="b1"
+
+--b1
+Content-Type: text/plain; charset="utf-8"
+
+Hello there
+--b1
+Content-Type: application/pdf; name="Invoice.PDF"
+Content-Disposition: attachment; filename="Invoice.PDF"
+Content-Transfer-Encoding: base64
+
+JVBERg==
+--b1
+Content-Type: image/png
+Content-ID: <logo>
+Content-Disposition: inline; filename="logo.png"
+Content-Transfer-Encoding: base64
+
+iVBORw==
+--b1
+Content-Type: application/zip; name="bundle.zip"
+Content-Transfer-Encoding: base64
+
+UEsDBA==
+--b1--
+"""
+
+
+class BodystructureTest(unittest.TestCase):
+    def test_dispositions_decide_what_counts(self):
+        self.assertEqual(attachment_types(MIXED), ['.pdf', '.png'])
+
+    def test_matches_walking_the_downloaded_message(self):
+        self.assertEqual(attachment_types(MIXED), downloaded_attachment_types(MIXED_MESSAGE))
+
+    def test_nested_message_is_walked(self):
+        self.assertEqual(attachment_types(NESTED), ['.docx'])
+
+    def test_encoded_and_literal_file_names(self):
+        self.assertEqual(attachment_types(ENCODED), ['.pdf', '.xls'])
+
+    def test_single_part_message_has_no_attachments(self):
+        self.assertEqual(attachment_types(TEXT_PART), [])
+        self.assertEqual(Test22.bodystructure_attachment_types(None), [])
+
+
+class FetchResponseTest(unittest.TestCase):
+    # The shape imaplib returns for "UID FETCH 11:12 (UID RFC822.SIZE BODY.PEEK[HEADER.FIELDS (FROM)])",
+    # with an unsolicited FLAGS update mixed in
+    RESPONSE = [
+        (b'2 (UID 12 RFC822.SIZE 400 BODY[HEADER.FIELDS (FROM)] {21}', b'From: b@example.com\r\n'),
+        b')',
+        b'7 (FLAGS (\\Seen))',
+        (b'1 (UID 11 RFC822.SIZE 300 BODYSTRUCTURE ' + TEXT_PART + b' BODY[HEADER.FIELDS (FROM)] {21}',
+         b'From: a@example.com\r\n'),
+        b')',
+    ]
+
+    def test_literals_are_paired_with_their_items(self):
+        messages = Test22.parse_fetch_response(self.RESPONSE)
+        self.assertEqual([num for num, _, _ in messages], [b'2', b'7', b'1'])
+        self.assertEqual(messages[0][2], [(b'BODY[HEADER.FIELDS (FROM)]', b'From: b@example.com\r\n')])
+        self.assertEqual(messages[1][2], [])
+        self.assertIn(b'RFC822.SIZE 300', messages[2][1])
+
+    def test_several_literals_in_one_message(self):
+        messages = Test22.parse_fetch_response([
+            (b'3 (UID 13 BODY[HEADER] {9}', b'Subject:\r\n'), (b' BODY[TEXT] {4}', b'body'), b')'])
+        self.assertEqual(len(messages), 1)
+        self.assertEqual([name for name, _ in messages[0][2]], [b'BODY[HEADER]', b'BODY[TEXT]'])
+
+    def test_collect_orders_by_uid_and_skips_unsolicited(self):
+        fetched = Test22.collect_fetch_response('OK', self.RESPONSE, '11:12', uid=True)
+        self.assertEqual([uid for uid, _, _ in fetched], [b'11', b'12'])
+
+    def test_no_reply_raises(self):
+        with self.assertRaises(Test22.imaplib.IMAP4.error):
+            Test22.collect_fetch_response('NO', [b'Some messages could not be fetched'], '1:2')
+
+
+if __name__ == '__main__':
+    unittest.main()
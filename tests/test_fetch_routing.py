@@ -0,0 +1,97 @@
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Test22
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.fetches = []
+
+    def uid(self, command, sequence_set, query):
+        self.fetches.append(sequence_set)
+        return 'OK', []
+
+
+class RecordingPool:
+    def __init__(self):
+        self.calls = 0
+
+    def run(self, folder, fetch, sequence_sets):
+        self.calls += 1
+        return iter(())
+
+
+class ExaminingConnection:
+    def __init__(self):
+        self.selected = []
+
+    def select(self, mailbox, readonly=False):
+        self.selected.append((mailbox, readonly))
+        return 'OK', [b'1']
+
+
+class QuotingPool(Test22.IMAPConnectionPool):
+    def open_connection(self):
+        return [ExaminingConnection(), None]
+
+
+class RefusingConnection(ExaminingConnection):
+    def uid(self, command, sequence_set, query):
+        return 'NO', [b'Some messages could not be fetched']
+
+
+class FetchRoutingTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = RecordingConnection()
+        self.organizer = SimpleNamespace(imap_server=self.connection, connection_pool=RecordingPool(),
+                                         fetch_batch_size=2, selected_folder='INBOX')
+
+    def fetch(self, query):
+        return list(Test22.EmailOrganizer.fetch_batches(self.organizer, range(1, 7), query, uid=True))
+
+    def test_peek_fetch_uses_pool(self):
+        self.fetch('(BODY.PEEK[])')
+        self.assertEqual(self.organizer.connection_pool.calls, 1)
+        self.assertEqual(self.connection.fetches, [])
+
+    def test_fetch_that_marks_seen_stays_on_main_session(self):
+        # Pool sessions are read-only, so \Seen would never be set there
+        for query in ('(RFC822)', '(BODY[])'):
+            self.fetch(query)
+        self.assertEqual(self.organizer.connection_pool.calls, 0)
+        self.assertEqual(len(self.connection.fetches), 6)
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def test_folder_names_are_quoted(self):
+        pool = QuotingPool('imap.example.com', 'me@example.com', 'secret', size=1)
+        entry = pool.acquire('[Gmail]/All Mail')
+        pool.release(entry)
+        entry = pool.acquire('INBOX')
+        self.assertEqual(entry[0].selected, [('"[Gmail]/All Mail"', True), ('INBOX', True)])
+
+    def test_no_reply_returns_session_to_pool(self):
+        pool = QuotingPool('imap.example.com', 'me@example.com', 'secret', size=2)
+        pool.open_connection = lambda: [RefusingConnection(), None]
+        fetch = lambda connection, sequence_set: Test22.fetch_sequence_set(connection, sequence_set, '(RFC822)', uid=True)
+        for _ in range(3):
+            with self.assertRaises(Test22.imaplib.IMAP4.error):
+                list(pool.run('INBOX', fetch, ['1:2', '3:4', '5:6']))
+        self.assertLessEqual(pool.created, 2)
+        self.assertEqual(pool.idle.qsize(), pool.created)
+
+    def test_acquire_times_out_when_every_session_is_busy(self):
+        pool = QuotingPool('imap.example.com', 'me@example.com', 'secret', size=1)
+        pool.ACQUIRE_TIMEOUT = 0.1
+        pool.acquire('INBOX')
+        with self.assertRaises(Test22.imaplib.IMAP4.error):
+            pool.acquire('INBOX')
+
+
+if __name__ == '__main__':
+    unittest.main()
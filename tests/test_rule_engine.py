@@ -0,0 +1,130 @@
+import os
+import sys
+import unittest
+from email.mime.text import MIMEText
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Test22
+
+
+def message(sender, subject, body):
+    msg = MIMEText(body)
+    msg['From'] = sender
+    msg['Subject'] = subject
+    return msg
+
+
+def rule(name, condition_type, value, folder):
+    return {'name': name, 'condition_type': condition_type, 'condition_value': value, 'folder': folder}
+
+
+# match_rule is the reference the compiled rule set must agree with
+REFERENCE = SimpleNamespace(check_body_content=lambda msg, keyword: Test22.EmailOrganizer.check_body_content(None, msg, keyword))
+
+
+def reference_index(rules, msg, start=0):
+    return next((index for index in range(start, len(rules))
+                 if Test22.EmailOrganizer.match_rule(REFERENCE, msg, rules[index])), None)
+
+
+RULES = [
+    rule('sale', 'subject', 'SALE', 'Promotions'),
+    rule('invoice', 'subject', 'invoice', 'Bills'),
+    rule('voice', 'subject', 'voice', 'Voicemail'),
+    rule('shop domain', 'domain', 'shop.com, @Store.example', 'Shops'),
+    rule('boss', 'from', 'boss@', 'Important'),
+    rule('otp', 'subject_regex', r'\bcode\s+\d{6}\b', 'OTP'),
+    rule('body', 'body', 'unsubscribe', 'Newsletters'),
+    rule('body regex', 'body_regex', r'order #\d+', 'Orders'),
+    {'name': 'urgent boss', 'condition_type': 'all', 'folder': 'Urgent', 'conditions': [
+        {'condition_type': 'from', 'condition_value': 'boss'},
+        {'condition_type': 'any', 'conditions': [{'condition_type': 'subject', 'condition_value': 'urgent'},
+                                                 {'condition_type': 'body', 'condition_value': 'asap'}]}]},
+    {'name': 'not from me', 'condition_type': 'not', 'folder': 'Other', 'conditions': [
+        {'condition_type': 'from', 'condition_value': 'me@example.com'}]},
+]
+
+MESSAGES = [
+    message('Deals <deals@shop.com>', 'Big Sale today', 'Click to unsubscribe'),
+    message('billing@utility.example', 'Your INVOICE is ready', 'Order #123 was paid'),
+    message('pbx@phone.example', 'New voicemail', 'You have a message'),
+    message('Boss <boss@example.com>', 'URGENT: report', 'Need it'),
+    message('Boss <boss@example.com>', 'Report', 'send it ASAP please'),
+    message('noreply@bank.example', 'Your code 482913', 'Do not share'),
+    message('me@example.com', 'Note to self', 'nothing here'),
+    message('orders@store.example', 'Shipped', 'Order #77 is on its way'),
+    message('friend@mail.example', 'Lunch?', 'unsubscribe me from lunch'),
+]
+
+
+class CompiledRuleSetTest(unittest.TestCase):
+    def assert_agrees(self, rules, start=0):
+        rule_set = Test22.CompiledRuleSet(rules)
+        for msg in MESSAGES:
+            self.assertEqual(rule_set.match_index(msg, start), reference_index(rules, msg, start),
+                             f"{msg['From']} / {msg['Subject']}")
+
+    def test_agrees_with_match_rule(self):
+        self.assert_agrees(RULES)
+
+    def test_first_match_wins_in_any_order(self):
+        self.assert_agrees(list(reversed(RULES)))
+        self.assert_agrees(RULES[3:] + RULES[:3])
+
+    def test_start_skips_earlier_rules(self):
+        for start in range(len(RULES)):
+            self.assert_agrees(RULES, start)
+
+    def test_overlapping_keywords_pick_lowest_rule(self):
+        # "invoice" contains "voice"; whichever rule comes first wins
+        msg = message('a@example.com', 'Invoice attached', '')
+        self.assertEqual(Test22.CompiledRuleSet([RULES[2], RULES[1]]).first_match(msg)['name'], 'voice')
+        self.assertEqual(Test22.CompiledRuleSet([RULES[1], RULES[2]]).first_match(msg)['name'], 'invoice')
+
+    def test_automaton_reports_every_pattern(self):
+        automaton = Test22.PatternAutomaton([('he', 0), ('she', 1), ('his', 2), ('hers', 3)])
+        self.assertEqual(automaton.search('ushers'), {0, 1, 3})
+        self.assertEqual(automaton.search('this'), {2})
+        self.assertEqual(automaton.search('nothing'), set())
+        self.assertEqual(automaton.min_value, 0)
+
+    def test_header_predicate_wins_without_decoding_body(self):
+        rule_set = Test22.CompiledRuleSet([rule('shop', 'from_regex', 'shop', 'A'), rule('zzz', 'body', 'zzz', 'B')])
+        view = Test22.MessageView(message('x@shop.com', 'Your order', 'zzz inside'))
+        self.assertEqual(rule_set.match_index(view), 0)
+        self.assertFalse(view.body_decoded)
+
+    def test_body_rule_ahead_of_header_predicate_still_wins(self):
+        rule_set = Test22.CompiledRuleSet([rule('zzz', 'body', 'zzz', 'B'), rule('shop', 'from_regex', 'shop', 'A')])
+        view = Test22.MessageView(message('x@shop.com', 'Your order', 'zzz inside'))
+        self.assertEqual(rule_set.match_index(view), 0)
+        self.assertTrue(view.body_decoded)
+
+
+class RuleRunTest(unittest.TestCase):
+    def rule_run(self, rules):
+        rule_set = Test22.CompiledRuleSet(rules)
+        organizer = SimpleNamespace(
+            rule_set=lambda: rule_set, classifier=SimpleNamespace(trained=False, revision=0),
+            app_settings={'classifier_fallback': False, 'classifier_threshold': 0.8},
+            template_cache=Test22.TemplateCache(100))
+        return Test22.RuleRun(organizer)
+
+    def test_header_predicate_decision_is_cached(self):
+        run = self.rule_run([rule('shop', 'from_regex', 'shop', 'A'), rule('zzz', 'body', 'zzz', 'B')])
+        self.assertEqual(run.decide(1, message('x@shop.com', 'Order 1234 shipped', 'zzz')), [(1, 'A', 0)])
+        self.assertEqual(len(run.template_cache.entries), 1)
+        # Same template, different digits: answered from the cache without running the rules
+        self.assertEqual(run.decide(2, message('x@shop.com', 'Order 5678 shipped', 'other')), [(2, 'A', 0)])
+        self.assertEqual(run.template_cache.hits, 1)
+
+    def test_body_decision_is_not_cached(self):
+        run = self.rule_run([rule('zzz', 'body', 'zzz', 'B'), rule('shop', 'from_regex', 'shop', 'A')])
+        self.assertEqual(run.decide(1, message('x@shop.com', 'Order 1234 shipped', 'zzz')), [(1, 'B', 0)])
+        self.assertEqual(len(run.template_cache.entries), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
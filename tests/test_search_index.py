@@ -0,0 +1,92 @@
+import os
+import sys
+import tempfile
+import unittest
+from email.mime.text import MIMEText
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Test22
+
+
+def entry(uid, subject):
+    return {'uid': uid, 'date': float(uid), 'sender': 'shop@example.com', 'subject': subject, 'body': None}
+
+
+class FakeMailbox:
+    # LIST and UID SEARCH ALL over a dict of folder -> UIDs
+    def __init__(self, folders):
+        self.folders = folders
+        self.selected = None
+
+    def list(self):
+        return 'OK', [b'(\\HasNoChildren) "/" "INBOX"', b'(\\HasNoChildren) "/" "Receipts"',
+                      b'(\\HasChildren \\Noselect) "/" "[Gmail]"', b'(\\HasNoChildren \\All) "/" "[Gmail]/All Mail"']
+
+    def uid(self, command, charset, criteria):
+        return 'OK', [' '.join(str(uid) for uid in self.folders[self.selected]).encode('ascii')]
+
+
+class SearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.index = Test22.SearchIndex(os.path.join(self.directory.name, 'email_cache.db'))
+
+    def tearDown(self):
+        self.index.db.close()
+        self.directory.cleanup()
+
+    def organizer(self, mailbox):
+        organizer = SimpleNamespace(search_index=self.index, email_address='me@example.com', imap_server=mailbox,
+                                    fetch_batch_size=50)
+
+        def select_folder(folder):
+            mailbox.selected = folder
+            return 7
+
+        def fetch_messages(uids, query, uid=False):
+            for fetched_uid in uids:
+                msg = MIMEText("Thanks for your order")
+                msg['From'] = 'shop@example.com'
+                msg['Subject'] = f'Invoice {fetched_uid}'
+                yield str(fetched_uid).encode('ascii'), None, msg
+
+        organizer.select_folder = select_folder
+        organizer.fetch_messages = fetch_messages
+        organizer.list_folders = lambda include_all_mail=True: Test22.EmailOrganizer.list_folders(
+            organizer, include_all_mail)
+        organizer.sync_search_index = lambda folders=None, job=None: Test22.EmailOrganizer.sync_search_index(
+            organizer, folders, job)
+        return organizer
+
+    def test_search_answers_from_index_without_server(self):
+        self.index.add('me@example.com', 'INBOX', 7, [entry(1, 'Your invoice')])
+        self.index.mark_synced('me@example.com', 'INBOX', 7)
+        organizer = SimpleNamespace(search_index=self.index, email_address='me@example.com', imap_server=None)
+        results = Test22.EmailOrganizer.search_emails(organizer, 'invoice', days=None)
+        self.assertEqual([result['folder'] for result in results], ['INBOX'])
+
+    def test_sync_skips_all_mail_and_prunes_deleted_messages(self):
+        mailbox = FakeMailbox({'INBOX': [1, 2, 3], 'Receipts': [5]})
+        organizer = self.organizer(mailbox)
+        # Left over from a sync that still included All Mail
+        self.index.add('me@example.com', '[Gmail]/All Mail', 9, [entry(1, 'Invoice 1')])
+        self.index.mark_synced('me@example.com', '[Gmail]/All Mail', 9)
+
+        self.assertEqual(Test22.EmailOrganizer.sync_search_index(organizer), "Indexed 4 emails")
+        self.assertEqual(self.index.synced_folders('me@example.com'), {'INBOX', 'Receipts'})
+        self.assertEqual(len(self.index.search('invoice', 'me@example.com')), 4)
+
+        # Deleted from another client, and one new message
+        mailbox.folders['INBOX'] = [1, 4]
+        self.assertEqual(Test22.EmailOrganizer.refresh_search_index(organizer), "Indexed 1 emails")
+        self.assertEqual(self.index.indexed_uids('me@example.com', 'INBOX', 7), {1, 4})
+
+    def test_refresh_needs_a_first_sync(self):
+        organizer = self.organizer(FakeMailbox({'INBOX': [1]}))
+        self.assertIsNone(Test22.EmailOrganizer.refresh_search_index(organizer))
+
+
+if __name__ == '__main__':
+    unittest.main()
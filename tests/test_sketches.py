@@ -0,0 +1,84 @@
+import math
+import os
+import sys
+import unittest
+from collections import Counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Test22
+
+
+# A Zipf-like stream of senders, split into days as the rollups would hold it
+def skewed_days(days=30, per_day=2000, senders=5000, seed=7):
+    rng = np.random.default_rng(seed)
+    weights = 1 / np.arange(1, senders + 1) ** 1.1
+    weights /= weights.sum()
+    return [Counter(f"s{index}@example.com" for index in rng.choice(senders, per_day, p=weights))
+            for _ in range(days)]
+
+
+class SketchTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.days = skewed_days()
+        cls.exact = sum(cls.days, Counter())
+        cls.total = sum(cls.exact.values())
+
+    def test_space_saving_bounds(self):
+        capacity = 200
+        summary = Test22.SpaceSaving(capacity)
+        for day in self.days:
+            for item, count in day.items():
+                summary.add(item, count)
+        self.assertLessEqual(len(summary.counts), capacity)
+        # Never under, and over by at most total/capacity
+        for item, count in summary.counts.items():
+            self.assertGreaterEqual(count, self.exact[item])
+            self.assertLessEqual(count - self.exact[item], self.total / capacity)
+        # Everything more frequent than total/capacity is held
+        for item, count in self.exact.items():
+            if count > self.total / capacity:
+                self.assertIn(item, summary.counts)
+
+    def test_count_min_bounds(self):
+        sketch = Test22.CountMinSketch(width=1024, depth=4)
+        for day in self.days:
+            sketch.add(list(day), np.fromiter(day.values(), dtype=np.int64))
+        items = list(self.exact)
+        estimates = sketch.estimate(items)
+        exact = np.array([self.exact[item] for item in items])
+        self.assertTrue((estimates >= exact).all())
+        # Within e/width of the total except with probability e**-depth
+        within = (estimates - exact) <= math.e / sketch.width * self.total
+        self.assertGreaterEqual(within.mean(), 1 - math.exp(-sketch.depth))
+
+    def test_heavy_hitters_match_exact_top(self):
+        hitters = Test22.HeavyHitters(100)
+        for day in self.days:
+            hitters.add(dict(day))
+        counts = hitters.counts()
+        for item, count in counts.items():
+            self.assertGreaterEqual(count, self.exact[item])
+            self.assertLessEqual(count, hitters.summary.counts[item])
+        self.assertEqual([item for item, _ in hitters.top(10)], [item for item, _ in self.exact.most_common(10)])
+
+    def test_sketched_merge_agrees_with_exact_merge(self):
+        hours = np.zeros(0, dtype=np.int64)
+        rollups = []
+        for number, day in enumerate(self.days):
+            rollup = Test22.day_rollup([], hours)
+            rollup.update(total=sum(day.values()), senders=dict(day), keywords={})
+            rollups.append((f"2026-09-{number + 1:02d}", rollup))
+        exact = Test22.merge_rollups(iter(rollups))
+        sketched = Test22.merge_rollups(iter(rollups), sketch_capacity=100)
+        self.assertEqual(sketched['total_emails'], exact['total_emails'])
+        self.assertEqual([item for item, _ in sketched['top_senders']], [item for item, _ in exact['top_senders']])
+        for item, count in sketched['top_senders']:
+            self.assertLessEqual(count - exact['sender_frequency'][item], self.total / 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import smtplib
+import sys
+import threading
+import time
+import unittest
+from email.mime.text import MIMEText
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Test22
+
+
+class StallingSMTP:
+    # send_message blocks until released, like a server that stopped answering
+    def __init__(self):
+        self.release = threading.Event()
+        self.sending = threading.Event()
+        self.quit_called = False
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def send_message(self, msg):
+        self.sending.set()
+        self.release.wait(5)
+        return {}
+
+    def quit(self):
+        self.quit_called = True
+
+
+class SMTPSessionTest(unittest.TestCase):
+    def setUp(self):
+        self.smtp = StallingSMTP()
+        organizer = SimpleNamespace(email_address='me@example.com', password='secret',
+                                    open_smtp=lambda host, port: self.smtp)
+        self.session = Test22.SMTPSession(organizer, 'smtp.example.com', 587)
+
+    def test_close_does_not_wait_for_a_stalled_send(self):
+        sender = threading.Thread(target=self.session.send, args=(MIMEText("Thanks"),))
+        sender.start()
+        self.assertTrue(self.smtp.sending.wait(5))
+        started = time.monotonic()
+        self.session.close()
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertFalse(self.smtp.quit_called)
+
+        # The send finishes and hands the connection back to close()
+        self.smtp.release.set()
+        sender.join(5)
+        self.assertTrue(self.smtp.quit_called)
+        self.assertIsNone(self.session.smtp)
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            self.session.send(MIMEText("Too late"))
+
+    def test_blocking_engine_connects_with_timeout(self):
+        organizer = SimpleNamespace(app_settings={'mail_engine': 'blocking'})
+        with mock.patch.object(Test22.smtplib, 'SMTP') as smtp, mock.patch.object(Test22.smtplib, 'SMTP_SSL') as smtp_ssl:
+            Test22.EmailOrganizer.open_smtp(organizer, 'smtp.example.com', 587)
+            Test22.EmailOrganizer.open_smtp(organizer, 'smtp.example.com', 465)
+        smtp.assert_called_once_with('smtp.example.com', 587, timeout=Test22.SMTP_TIMEOUT)
+        smtp_ssl.assert_called_once_with('smtp.example.com', 465, timeout=Test22.SMTP_TIMEOUT)
+
+
+if __name__ == '__main__':
+    unittest.main()